@@ -1,26 +1,748 @@
-from llama_cpp import Llama
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
-# Load model
-llm = Llama(
-    model_path="PATH_TO_THE_MODEL",
-    n_ctx=2048,
-    n_threads=6
-)
+from answer_cache import AnswerCache, normalize_question
+from backends import check_model, get_backend
+from knowledge_base import KnowledgeBase
+from metrics import MetricsLog, RequestMetrics
+from model_config import load_profile
+from model_planner import plan, read_gguf
+from semantic_cache import SemanticCache
+from session_store import MIN_SNAPSHOT_GAIN, MIN_SNAPSHOT_TOKENS, SessionStore, pack_state, unpack_state
+from stopping import DEFAULT_INTENTS, DEFAULT_STOP_PATTERNS, StopRules, intents_from_config
 
-# Load static company info
-with open("company_info.txt", "r") as f:
-    company_info = f.read()
+# Model settings come from the selected profile in ai_agent.toml (see
+# model_config.py); these defaults apply to anything it leaves out
+_profile = load_profile()
+MODEL_PATH = _profile.pop("model_path", "PATH_TO_THE_MODEL")
+# "llama_cpp", or "stub" for the simulated model in stub_llama.py (no weights
+# needed); see backends.py
+MODEL_BACKEND = _profile.pop("backend", "llama_cpp")
+# A single file, or a directory of .txt/.md/.rst documents
+COMPANY_INFO_PATH = "company_info.txt"
+ANSWER_CACHE_PATH = "answer_cache.sqlite3"
+METRICS_LOG_PATH = "metrics.jsonl"
+# Model states saved after long prompts so a conversation (or the company
+# info prefix) resumes after a restart without evaluating it all again
+SESSIONS = _profile.pop("sessions", True)
+SESSION_DIR = _profile.pop("session_dir", "sessions")
+SESSION_MAX_BYTES = _profile.pop("session_max_bytes", 4 * 1024 * 1024 * 1024)
+N_CTX = _profile.pop("n_ctx", 2048)
+# Before loading, the model and N_CTX are fitted to MEMORY_BUDGET_MB (85% of
+# the memory available at startup by default): the largest quantization of
+# the model in MODEL_DIR that fits is used instead of MODEL_PATH, or N_CTX is
+# lowered, or loading fails instead of swapping (see model_planner.py)
+MODEL_DIR = _profile.pop("model_dir", None)
+MEMORY_BUDGET_MB = _profile.pop("memory_budget_mb", None)
+PLAN_MEMORY = _profile.pop("plan_memory", True)
+N_THREADS = _profile.pop("n_threads", 6)
+# Small GGUF model with the same vocabulary that drafts tokens for the main
+# model to verify (speculative decoding), and how many it drafts per step
+DRAFT_MODEL_PATH = _profile.pop("draft_model_path", None)
+DRAFT_TOKENS = _profile.pop("draft_tokens", 8)
+# Answer questions that mean the same as one answered before from cache.
+# Questions are embedded with EMBEDDING_MODEL_PATH, or with the main model
+# file loaded a second time in embedding mode (mmap shares the weights). A
+# chat model's pooled embeddings don't separate unrelated questions reliably
+# at SEMANTIC_THRESHOLD, so the cache is only on by default with an
+# embedding model.
+EMBEDDING_MODEL_PATH = _profile.pop("embedding_model_path", None)
+SEMANTIC_CACHE = _profile.pop("semantic_cache", EMBEDDING_MODEL_PATH is not None)
+SEMANTIC_THRESHOLD = _profile.pop("semantic_threshold", 0.92)
+SEMANTIC_MAX_BYTES = _profile.pop("semantic_max_bytes", 32 * 1024 * 1024)
+SEMANTIC_BACKEND = _profile.pop("semantic_backend", "flat")
+EMBEDDING_N_CTX = 512
+# Requests decoded together in one batch over the loaded model (continuous
+# batching, see batch_engine.py). 1 answers one request at a time.
+BATCH_SLOTS = _profile.pop("batch_slots", 1)
+# Every other Llama() argument of the profile: n_batch, n_threads_batch,
+# use_mmap, use_mlock, type_k, type_v, ...
+MODEL_OPTIONS = _profile
+MAX_TOKENS = 200
+STOP = ["User:", "You:"]
+GENERATION_PARAMS = {"max_tokens": MAX_TOKENS, "stop": STOP}
+# Answers also end at these regular expressions, and questions matching an
+# intent get its smaller token budget and sentence limit (see stopping.py)
+STOP_PATTERNS = _profile.pop("stop_patterns", DEFAULT_STOP_PATTERNS)
+INTENTS = intents_from_config(_profile.pop("intents")) if "intents" in _profile else DEFAULT_INTENTS
+# "json", or the path of a GBNF grammar file, to constrain what the model
+# can generate; only the token budget ends a constrained answer early
+GRAMMAR = _profile.pop("grammar", None)
+HISTORY_TOKENS = 768
+# Old messages are dropped this many at a time, so the start of the history
+# window (and the KV cache built on it) stays put for several turns
+HISTORY_STEP = 4
+SCHEDULER_MAX_PENDING = 32
 
-def build_prompt(user_question: str, info: str) -> str:
+# Model is created on first use (or by load_model_async) so importing this
+# module does not wait for the weights to load
+llm = None
+prefix_cache = None
+embedder = None
+batch_engine = None
+grammar = None
+_load_lock = threading.Lock()
+
+# Serializes access to llm, which is not thread-safe. With BATCH_SLOTS > 1
+# several inference workers share it for prompt preparation, while the
+# tokens themselves are generated by batch_engine.
+llm_lock = threading.Lock()
+_embed_lock = threading.Lock()
+
+# Load company info and its retrieval index, and reload it whenever it
+# changes on disk
+knowledge_base = KnowledgeBase(COMPANY_INFO_PATH)
+knowledge_base.refresh()
+knowledge_base.watch()
+company_info = knowledge_base.text
+
+# Answers already generated for the current knowledge base and model
+answer_cache = AnswerCache(ANSWER_CACHE_PATH)
+
+# Answers of earlier questions with the same meaning
+semantic_cache = SemanticCache(SEMANTIC_THRESHOLD, SEMANTIC_MAX_BYTES, SEMANTIC_BACKEND)
+
+# Per-request timings and token counts
+metrics_log = MetricsLog(METRICS_LOG_PATH)
+
+# Model states and conversations kept on disk between runs
+session_store = SessionStore(SESSION_DIR, SESSION_MAX_BYTES) if SESSIONS else None
+
+# Where answers are cut off while they stream
+stop_rules = StopRules(STOP, STOP_PATTERNS, INTENTS, grammar=GRAMMAR is not None)
+
+def build_prefix(info: str) -> str:
+    """Static part of the prompt shared by every question"""
     return (
         "You are a helpful AI assistant.\n\n"
         "Use this company information to answer the user's question:\n\n"
         f"{info}\n\n"
+    )
+
+def format_history(history) -> str:
+    lines = []
+    for message in history:
+        speaker = "User" if message["role"] == "user" else "Assistant"
+        lines.append(f"{speaker}: {message['content'].strip()}\n")
+    return "".join(lines)
+
+def build_prompt(user_question: str, info: str, history=None) -> str:
+    return (
+        build_prefix(info) +
+        format_history(history or []) +
         f"User: {user_question}\n"
         "Assistant:"
     )
 
-def get_answer(user_input: str) -> str:
-    prompt = build_prompt(user_input, company_info)
-    output = llm(prompt, max_tokens=200, stop=["User:", "You:"])
-    return output["choices"][0]["text"].strip()
\ No newline at end of file
+
+class PrefixCache:
+    """Snapshot of the llama state after evaluating a static prompt prefix.
+
+    The preamble and company info are evaluated once; every question restores
+    the snapshot so llm only has to evaluate the question tokens. A different
+    prefix (e.g. after company_info.txt changed) replaces the snapshot.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.prefix = None
+        self.tokens = []
+        self.state = None
+
+    def invalidate(self):
+        self.prefix = None
+        self.tokens = []
+        self.state = None
+
+    def restore(self, prefix: str):
+        """Load the state for prefix into the model. Must be called with llm_lock held.
+
+        Nothing is loaded while the model's context still starts with the
+        prefix, so the previous turn's tokens stay available for reuse.
+        """
+        if self.state is None or prefix != self.prefix:
+            tokens = self.model.tokenize(prefix.encode("utf-8"), special=True)
+            self.model.reset()
+            restored = resume_session(self.model, tokens)
+            if self.model.n_tokens < len(tokens):
+                self.model.eval(tokens[self.model.n_tokens:])
+                save_session(self.model, tokens, restored)
+            self.state = self.model.save_state()
+            self.prefix = prefix
+            self.tokens = tokens
+        elif not self.is_live():
+            self.model.load_state(self.state)
+
+    def is_live(self) -> bool:
+        n = len(self.tokens)
+        return self.model.n_tokens >= n and list(self.model.input_ids[:n]) == self.tokens
+
+
+def session_scope() -> str:
+    """Everything other than the tokens that a saved model state depends on"""
+    return json.dumps([MODEL_BACKEND, MODEL_PATH, MODEL_OPTIONS.get("type_k"), MODEL_OPTIONS.get("type_v")])
+
+def common_prefix(a, b) -> int:
+    """Number of leading tokens a and b have in common"""
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+def live_tokens(model, tokens) -> int:
+    """Number of leading tokens of tokens already evaluated in model's context"""
+    return common_prefix(model.input_ids[:model.n_tokens], tokens)
+
+def resume_session(model, tokens) -> int:
+    """Load the longest saved state that tokens start with, if it covers more than model holds.
+
+    Returns how many tokens were restored. Must be called with llm_lock held.
+    """
+    if session_store is None:
+        return 0
+    live = live_tokens(model, tokens)
+    found = session_store.find(session_scope(), tokens, max(MIN_SNAPSHOT_TOKENS, live + 1))
+    if found is None:
+        return 0
+    key, n = found
+    arrays = session_store.load(key)
+    if arrays is None:
+        return 0
+    try:
+        model.load_state(unpack_state(arrays, get_backend(MODEL_BACKEND).state_type(), model.n_ctx()))
+    except Exception as e:
+        # Saved with a different build or a smaller context
+        logging.getLogger(__name__).warning("Dropping session snapshot that no longer loads: %s", e)
+        session_store.remove(key)
+        model.reset()
+        return 0
+    # Whatever the saved state holds past the shared tokens is evaluated again
+    model.n_tokens = live_tokens(model, tokens)
+    return n
+
+def save_session(model, tokens, restored: int = 0):
+    """Evaluate tokens in model and save its state after them.
+
+    Nothing is saved when the restored tokens just loaded from disk, or a
+    saved state, already cover most of tokens. Must be called with llm_lock
+    held; the file is written in the background.
+    """
+    if session_store is None or len(tokens) < MIN_SNAPSHOT_TOKENS or restored > len(tokens) - MIN_SNAPSHOT_GAIN:
+        return
+    if session_store.find(session_scope(), tokens, len(tokens) - MIN_SNAPSHOT_GAIN + 1, queued=True) is not None:
+        return
+    # Drops anything model holds past tokens, so the state ends where they do
+    model.n_tokens = live_tokens(model, tokens)
+    model.eval(tokens[model.n_tokens:])
+    session_store.save(session_scope(), tokens, pack_state(model.save_state()))
+
+def save_conversation(history: list, name: str = "default"):
+    """Keep history on disk so load_conversation() returns it after a restart"""
+    if session_store is not None:
+        session_store.save_conversation(name, history)
+
+def load_conversation(name: str = "default") -> list:
+    return session_store.load_conversation(name) if session_store is not None else []
+
+def count_tokens(text: str) -> int:
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+def history_window(history, budget: int) -> list:
+    """Return the most recent messages of history that fit in budget tokens"""
+    messages = [m for m in history if m.get("role") in ("user", "assistant") and m.get("content")]
+    total = 0
+    start = len(messages)
+    while start > 0:
+        total += count_tokens(format_history(messages[start - 1:start]))
+        if total > budget:
+            break
+        start -= 1
+    # Round up to a multiple of HISTORY_STEP so the window start only moves
+    # every few turns instead of on every turn
+    start = -(-start // HISTORY_STEP) * HISTORY_STEP
+    return messages[start:]
+
+def prepare_prompt(user_input: str, history=None, snapshot=None, request: RequestMetrics = None) -> tuple:
+    """Build the prompt for user_input, keeping it within the context window.
+
+    Earlier messages of the conversation are included up to HISTORY_TOKENS.
+    When the whole company info fits it is used as a cached static prefix;
+    otherwise only the passages most relevant to the question are included.
+    snapshot is the knowledge base snapshot to answer from (the current one
+    by default). Time spent evaluating the prefix is recorded in request as
+    prefix_prefill. Must be called with llm_lock held.
+
+    Returns the prompt and the start of it that the conversation's next
+    prompt begins with too: the company info and earlier messages, or ""
+    when there are none or only some passages were included.
+    """
+    snapshot = snapshot or knowledge_base.snapshot
+    budget = llm.n_ctx() - GENERATION_PARAMS["max_tokens"] - count_tokens(build_prompt(user_input, "")) - 1
+    window = history_window(history or [], min(HISTORY_TOKENS, budget // 2))
+    budget -= count_tokens(format_history(window))
+    info, is_whole_file = snapshot.context(user_input, budget, count_tokens)
+    if is_whole_file and batch_engine is None:
+        # The batch engine shares the prefix between its own sequences
+        start = time.perf_counter()
+        prefix_cache.restore(build_prefix(info))
+        if request is not None:
+            request.prefix_prefill = time.perf_counter() - start
+    head = build_prefix(info) + format_history(window) if window and is_whole_file else ""
+    return build_prompt(user_input, info, window), head
+
+def create_model():
+    """Create the model for MODEL_BACKEND from the current settings"""
+    options = {
+        # Prompt evaluation would otherwise use every core, which
+        # oversubscribes the CPU when several processes run models
+        "n_threads_batch": N_THREADS,
+        **MODEL_OPTIONS,
+    }
+    if BATCH_SLOTS <= 1:
+        # The batch engine samples by itself, without the draft model
+        options.update(draft_model_path=DRAFT_MODEL_PATH, draft_tokens=DRAFT_TOKENS)
+    model = get_backend(MODEL_BACKEND).create_model(MODEL_PATH, N_CTX, N_THREADS, **options)
+    check_model(model, MODEL_BACKEND)
+    return model
+
+def plan_memory():
+    """Fit MODEL_PATH and N_CTX to the memory budget; returns the model_planner.Plan, or None if not planned"""
+    global MODEL_PATH, N_CTX
+    if not PLAN_MEMORY or not get_backend(MODEL_BACKEND).memory_planning:
+        return None
+    if not MODEL_DIR and not os.path.isfile(MODEL_PATH):
+        # Llama reports the missing file
+        return None
+    # The batch engine has a context of N_CTX tokens per slot and one for the shared prefix
+    n_contexts = 1 + (BATCH_SLOTS + 1 if BATCH_SLOTS > 1 else 0)
+    extra = 0
+    if DRAFT_MODEL_PATH and BATCH_SLOTS <= 1 and os.path.isfile(DRAFT_MODEL_PATH):
+        extra = read_gguf(DRAFT_MODEL_PATH).memory_bytes(N_CTX, MODEL_OPTIONS.get("type_k", 1),
+                                                         MODEL_OPTIONS.get("type_v", 1))
+    result = plan(
+        MODEL_PATH, N_CTX,
+        budget=MEMORY_BUDGET_MB * 1024 * 1024 if MEMORY_BUDGET_MB else None,
+        type_k=MODEL_OPTIONS.get("type_k", 1),
+        type_v=MODEL_OPTIONS.get("type_v", 1),
+        model_dir=MODEL_DIR,
+        n_contexts=n_contexts,
+        extra_bytes=extra,
+        n_batch=MODEL_OPTIONS.get("n_batch", 512),
+    )
+    for note in result.notes:
+        logging.getLogger(__name__).warning("Memory plan: %s", note)
+    MODEL_PATH, N_CTX = result.model_path, result.n_ctx
+    return result
+
+def create_batch_engine(model):
+    """BatchEngine decoding up to BATCH_SLOTS requests at once with model's weights"""
+    from batch_engine import BatchEngine
+
+    # One more sequence holds the shared prompt prefix
+    n_seq = BATCH_SLOTS + 1
+    context = get_backend(MODEL_BACKEND).create_batch_context(model, n_seq, N_CTX * n_seq)
+    return BatchEngine(context, BATCH_SLOTS, context.n_batch, N_CTX)
+
+def load_grammar():
+    """The backend's grammar for GRAMMAR, or None when output is unconstrained"""
+    if not GRAMMAR:
+        return None
+    if BATCH_SLOTS > 1:
+        logging.getLogger(__name__).warning("The grammar is not applied with batch_slots above 1")
+        return None
+    return get_backend(MODEL_BACKEND).load_grammar(GRAMMAR)
+
+def load_model():
+    """Return the Llama instance, loading it on the first call"""
+    global llm, prefix_cache, batch_engine, grammar
+    with _load_lock:
+        if llm is None:
+            plan_memory()
+            model = create_model()
+            prefix_cache = PrefixCache(model)
+            if BATCH_SLOTS > 1:
+                batch_engine = create_batch_engine(model)
+            grammar = load_grammar()
+            llm = model
+    return llm
+
+def unload_model():
+    """Drop the model so the next load_model() call creates it from the current settings"""
+    global llm, prefix_cache, embedder, batch_engine
+    with _load_lock, llm_lock, _embed_lock:
+        if batch_engine is not None:
+            batch_engine.close()
+        llm = None
+        prefix_cache = None
+        embedder = None
+        batch_engine = None
+
+def load_embedder():
+    """Return the embedding model, loading it on the first call. Call with _embed_lock held."""
+    global embedder
+    if embedder is None:
+        embedder = get_backend(MODEL_BACKEND).create_embedder(EMBEDDING_MODEL_PATH or MODEL_PATH,
+                                                              EMBEDDING_N_CTX, N_THREADS)
+    return embedder
+
+def is_model_loaded() -> bool:
+    return llm is not None
+
+class QueueFullError(RuntimeError):
+    """Raised when the inference queue has no room for another request"""
+
+
+class InferenceScheduler:
+    """Runs all model work on worker threads fed by a bounded queue.
+
+    Callers get a concurrent.futures.Future back. Requests that are still
+    waiting can be cancelled with future.cancel(); submitting to a full queue
+    blocks (or raises QueueFullError when block is False or timeout expires).
+    There is one worker unless requests are batched, in which case each
+    batch slot gets one to feed it.
+    """
+
+    def __init__(self, max_pending: int = 32, workers: int = 1):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._workers = workers
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def submit(self, fn, *args, block: bool = True, timeout: float = None) -> Future:
+        future = Future()
+        try:
+            self._queue.put((future, fn, args), block=block, timeout=timeout)
+        except queue.Full:
+            raise QueueFullError("Too many requests are waiting, please try again shortly")
+        self._ensure_worker()
+        return future
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            while len(self._threads) < self._workers:
+                thread = threading.Thread(target=self._run, name=f"inference-worker-{len(self._threads)}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            future, fn, args = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue  # Cancelled while pending
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+# The only threads that touch llm
+scheduler = InferenceScheduler(SCHEDULER_MAX_PENDING, max(1, BATCH_SLOTS))
+
+def load_model_async(callback=None) -> Future:
+    """Load the model on an inference worker.
+
+    callback, if given, is called from the worker with None on success or
+    the exception that stopped the model from loading.
+    """
+    future = scheduler.submit(load_model)
+    if callback is not None:
+        future.add_done_callback(lambda f: callback(f.exception()))
+    return future
+
+def generation_settings() -> dict:
+    """Everything besides the question, knowledge base and model that shapes an answer"""
+    return {**GENERATION_PARAMS, "stopping": stop_rules.describe()}
+
+def model_scope() -> str:
+    """The backend, model and context size an answer was generated with"""
+    return json.dumps([MODEL_BACKEND, MODEL_PATH, N_CTX])
+
+def answer_cache_key(user_input: str, history=None, snapshot=None):
+    """Cache key for user_input, or None when earlier turns make the answer uncacheable"""
+    if history:
+        return None
+    snapshot = snapshot or knowledge_base.snapshot
+    return AnswerCache.make_key(user_input, snapshot.digest, model_scope(), generation_settings())
+
+def _on_knowledge_change(snapshot):
+    """Drop everything derived from the previous knowledge base content"""
+    global company_info
+    company_info = snapshot.text
+    # Every cached answer is keyed on the old digest and can't be hit again
+    answer_cache.clear()
+    semantic_cache.clear()
+    with llm_lock:
+        if prefix_cache is not None:
+            prefix_cache.invalidate()
+    if batch_engine is not None:
+        batch_engine.invalidate_prefix()
+
+knowledge_base.on_change(_on_knowledge_change)
+
+def _consume(stream, request: RequestMetrics, pieces: list, terminator, cancel_event: threading.Event = None,
+             on_text=None):
+    """Collect the text chunks of stream into pieces until it ends, terminator stops it or cancel_event is set"""
+    def emit(text):
+        if text:
+            pieces.append(text)
+            if on_text is not None:
+                on_text(text)
+
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                request.cancelled = True
+                break
+            if request.first_token is None:
+                request.first_token = time.perf_counter()
+            request.completion_tokens += 1
+            text, stopped = terminator.feed(chunk["choices"][0]["text"])
+            emit(text)
+            if stopped:
+                break
+        else:
+            # Whatever was held back in case it started a stop string
+            emit(terminator.feed("", final=True)[0])
+    finally:
+        stream.close()
+
+def _complete(user_input: str, history, snapshot, request: RequestMetrics,
+              cancel_event: threading.Event = None, on_text=None) -> str:
+    """Generate the answer to user_input, recording timings and token counts in request.
+
+    on_text, if given, is called with each piece of text as it is generated.
+    Runs on an inference worker.
+    """
+    request.build_started = time.perf_counter()
+    pieces = []
+    terminator, max_tokens = stop_rules.start(user_input, GENERATION_PARAMS["max_tokens"])
+    # Stop strings are handled by terminator, so it knows why the answer ended
+    params = {**GENERATION_PARAMS, "max_tokens": max_tokens, "stop": []}
+    with metrics_log.profile(request):
+        load_model()
+        engine = batch_engine
+        with llm_lock:
+            draft = getattr(llm, "draft_model", None)
+            if hasattr(draft, "begin"):
+                draft.begin()
+            prompt, head = prepare_prompt(user_input, history, snapshot, request)
+            request.prompt_built = time.perf_counter()
+            tokens = llm.tokenize(prompt.encode("utf-8"), special=True)
+            request.tokenized = time.perf_counter()
+            request.prompt_tokens = len(tokens)
+            if engine is None:
+                restored = resume_session(llm, tokens)
+                if head:
+                    # Saved up to the end of the earlier messages, where the
+                    # next turn's prompt still matches this one
+                    head_tokens = llm.tokenize(head.encode("utf-8"), special=True)
+                    save_session(llm, tokens[:common_prefix(head_tokens, tokens)], restored)
+                try:
+                    _consume(llm(tokens, stream=True, grammar=grammar, **params), request, pieces,
+                             terminator, cancel_event, on_text)
+                finally:
+                    if hasattr(draft, "begin"):
+                        request.draft_proposed = draft.proposed
+                        request.draft_accepted = draft.accepted
+        if engine is not None:
+            # Decoded together with the other requests in flight, without holding llm_lock
+            stream = engine.stream(tokens, **params)
+            _consume(stream, request, pieces, terminator, cancel_event, on_text)
+            # The engine's chunks merge tokens held back for stop strings
+            request.completion_tokens = len(stream.sequence.generated)
+    request.finished = time.perf_counter()
+    if terminator.reason is not None:
+        request.stop_reason = terminator.reason
+    elif max_tokens < GENERATION_PARAMS["max_tokens"] and request.completion_tokens >= max_tokens:
+        request.stop_reason = "intent_length"
+    if request.stop_reason is not None:
+        # Tokens the answer could otherwise have run on for
+        request.tokens_saved = GENERATION_PARAMS["max_tokens"] - request.completion_tokens
+    return "".join(pieces).strip()
+
+def _semantic_key(user_input: str, history, snapshot, request: RequestMetrics):
+    """(embedding, scope) to look user_input up in the semantic cache, or None if it can't be.
+
+    Runs on an inference worker.
+    """
+    global SEMANTIC_CACHE
+    if not SEMANTIC_CACHE or history:
+        return None
+    request.embed_started = time.perf_counter()
+    try:
+        with _embed_lock:
+            vector = load_embedder().embed(normalize_question(user_input))
+        request.embedded = time.perf_counter()
+    except Exception as e:
+        # A model without embedding support shouldn't stop answers
+        SEMANTIC_CACHE = False
+        logging.getLogger(__name__).warning("Semantic cache disabled: %s", e)
+        return None
+    scope = AnswerCache.make_key("", snapshot.digest, model_scope(), generation_settings())
+    return vector, scope
+
+def _semantic_hit(user_input: str, semantic, request: RequestMetrics):
+    """The cached answer of a question that means the same as user_input, or None"""
+    if semantic is None:
+        return None
+    answer = semantic_cache.get(*semantic)
+    if answer is not None:
+        request.cached = True
+        request.semantic = True
+    return answer
+
+def _generate(user_input: str, history, snapshot, cache_key: str, request: RequestMetrics,
+              use_cache: bool = True) -> dict:
+    request.started = time.perf_counter()
+    try:
+        semantic = _semantic_key(user_input, history, snapshot, request)
+        answer = _semantic_hit(user_input, semantic, request) if use_cache else None
+        if answer is None:
+            answer = _complete(user_input, history, snapshot, request)
+    except Exception as e:
+        request.error = str(e)
+        metrics_log.finish(request)
+        raise
+
+    if answer and use_cache and not request.cached:
+        if cache_key:
+            answer_cache.put(cache_key, answer)
+        if semantic:
+            semantic_cache.put(*semantic, user_input, answer)
+    return {
+        "answer": answer,
+        "cached": request.cached,
+        "prompt_tokens": request.prompt_tokens,
+        "completion_tokens": request.completion_tokens,
+        "metrics": metrics_log.finish(request),
+    }
+
+def _generate_stream(user_input: str, history, snapshot, cache_key: str, out: queue.Queue,
+                     cancel_event: threading.Event, request: RequestMetrics):
+    """Put text pieces into out, followed by None or the exception that stopped generation"""
+    request.started = time.perf_counter()
+    try:
+        semantic = _semantic_key(user_input, history, snapshot, request)
+        answer = _semantic_hit(user_input, semantic, request)
+        if answer is not None:
+            out.put(answer)
+        else:
+            answer = _complete(user_input, history, snapshot, request, cancel_event, out.put)
+    except Exception as e:
+        request.error = str(e)
+        metrics_log.finish(request)
+        out.put(e)
+        raise
+
+    if answer and not request.cached and not request.cancelled:
+        if cache_key:
+            answer_cache.put(cache_key, answer)
+        if semantic:
+            semantic_cache.put(*semantic, user_input, answer)
+    metrics_log.finish(request)
+    out.put(None)
+    return answer
+
+def _cache_hit(user_input: str, request: RequestMetrics = None) -> dict:
+    request = request or RequestMetrics(user_input)
+    request.cached = True
+    return metrics_log.finish(request)
+
+def get_answer_details(user_input: str, block: bool = True, timeout: float = None,
+                       use_cache: bool = True, history=None) -> dict:
+    """Answer user_input and report where it came from and how many tokens it took.
+
+    history is the earlier conversation as a list of {"role", "content"}
+    messages, oldest first.
+    """
+    # The request answers from the knowledge base as it is now, even if it
+    # is reloaded while the request waits in the queue
+    snapshot = knowledge_base.snapshot
+    cache_key = answer_cache_key(user_input, history, snapshot)
+    cached = answer_cache.get(cache_key) if use_cache and cache_key else None
+    if cached is not None:
+        return {"answer": cached, "cached": True, "prompt_tokens": 0, "completion_tokens": 0,
+                "metrics": _cache_hit(user_input)}
+
+    request = RequestMetrics(user_input)
+    return scheduler.submit(_generate, user_input, history, snapshot, cache_key, request, use_cache,
+                            block=block, timeout=timeout).result()
+
+def get_answer(user_input: str, block: bool = True, timeout: float = None, history=None) -> str:
+    return get_answer_details(user_input, block, timeout, history=history)["answer"]
+
+def submit_answer_stream(user_input: str, out, cancel_event: threading.Event,
+                         block: bool = True, timeout: float = None, history=None,
+                         request: RequestMetrics = None) -> Future:
+    """Queue user_input for generation and stream the answer into out.
+
+    out is anything with a put() method. It receives text pieces followed by
+    None when the answer is complete (or the request was cancelled), or by the
+    exception that stopped generation. A cached answer is put in one piece
+    without going through the queue. request, if given, is filled in with the
+    request's metrics, including its token counts, before None is put.
+    """
+    snapshot = knowledge_base.snapshot
+    cache_key = answer_cache_key(user_input, history, snapshot)
+    cached = answer_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        _cache_hit(user_input, request)
+        out.put(cached)
+        out.put(None)
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    request = request or RequestMetrics(user_input)
+    future = scheduler.submit(_generate_stream, user_input, history, snapshot, cache_key, out, cancel_event,
+                              request, block=block, timeout=timeout)
+    future.add_done_callback(lambda f: out.put(None) if f.cancelled() else None)
+    return future
+
+def stream_answer(user_input: str, cancel_event: threading.Event = None,
+                  block: bool = True, timeout: float = None, history=None):
+    """Yield the answer text piece by piece as llm generates it.
+
+    Generation stops after the current token once cancel_event is set, and a
+    request still waiting in the queue is dropped. A cached answer is yielded
+    in one piece.
+    """
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    out = queue.Queue()
+    future = submit_answer_stream(user_input, out, cancel_event, block, timeout, history)
+    finished = False
+    try:
+        while True:
+            try:
+                item = out.get(timeout=0.1)
+            except queue.Empty:
+                if cancel_event.is_set() and future.cancel():
+                    finished = True
+                    return
+                continue
+            if item is None:
+                finished = True
+                return
+            if isinstance(item, Exception):
+                finished = True
+                raise item
+            yield item
+    finally:
+        if not finished:
+            # Consumer went away: stop generating for it
+            cancel_event.set()
+            future.cancel()
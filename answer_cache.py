@@ -0,0 +1,102 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 7 * 24 * 3600  # seconds
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return _WHITESPACE.sub(" ", question.lower()).strip().rstrip("?!. ")
+
+
+class AnswerCache:
+    """SQLite-backed cache of generated answers with LRU and TTL eviction.
+
+    Entries are keyed on the normalized question together with everything that
+    can change the answer: the knowledge base hash, the model and the
+    generation parameters. One connection is shared behind a lock, so the cache
+    can be used from several threads.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY,"
+            " answer TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+
+    @staticmethod
+    def make_key(question: str, kb_digest: str, model: str, params: dict) -> str:
+        payload = json.dumps(
+            [normalize_question(question), kb_digest, model, params],
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Return the cached answer for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, answer: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now),
+            )
+            self._conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                " SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
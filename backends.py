@@ -0,0 +1,156 @@
+"""Inference backends ai_agent can run on.
+
+A backend creates the model objects used for answers, embeddings and batched
+decoding. Models follow the part of the llama_cpp.Llama interface described
+by Model, so ai_agent works the same on every backend:
+
+    llama_cpp   GGUF models through llama-cpp-python
+    stub        the deterministic simulated model of stub_llama.py, with
+                configurable prefill and decode latency and no weights, for
+                load tests of the scheduler, caches, GUI and batch mode
+
+MODEL_BACKEND (the "backend" key of a profile) selects one from BACKENDS.
+"""
+from typing import Protocol
+
+
+class Model(Protocol):
+    """What ai_agent needs from a model object"""
+
+    input_ids: list  # Tokens in the context; the first n_tokens are evaluated
+    n_tokens: int
+
+    def n_ctx(self) -> int: ...
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> list: ...
+
+    def detokenize(self, tokens, prev_tokens=None, special: bool = False) -> bytes: ...
+
+    def reset(self): ...
+
+    def eval(self, tokens): ...
+
+    def save_state(self): ...
+
+    def load_state(self, state): ...
+
+    def embed(self, text: str, **kwargs) -> list: ...
+
+    def __call__(self, prompt, max_tokens: int = 16, stop=None, stream: bool = False, **kwargs):
+        """A completion, or with stream=True an iterator of chunks, shaped like Llama's"""
+
+
+MODEL_ATTRIBUTES = ("input_ids", "n_tokens", "n_ctx", "tokenize", "detokenize", "reset", "eval",
+                    "save_state", "load_state", "embed", "__call__")
+
+
+def check_model(model, backend: str):
+    """Raise TypeError if model is missing part of the Model interface"""
+    missing = [name for name in MODEL_ATTRIBUTES if not hasattr(model, name)]
+    if missing:
+        raise TypeError(f"The {backend} backend's model lacks {', '.join(sorted(missing))}")
+
+
+class LlamaCppBackend:
+    """GGUF models run by llama-cpp-python"""
+
+    name = "llama_cpp"
+    # Model files are GGUF, so model_planner can size them before loading
+    memory_planning = True
+
+    def create_model(self, model_path: str, n_ctx: int, n_threads: int, draft_model_path: str = None,
+                     draft_tokens: int = 8, **options) -> Model:
+        """The model for answers, with speculative decoding when draft_model_path is given"""
+        from llama_cpp import Llama
+
+        draft = None
+        if draft_model_path:
+            from speculative import DraftModel
+
+            draft = DraftModel(draft_model_path, draft_tokens, n_ctx=n_ctx, n_threads=n_threads,
+                               n_threads_batch=options.get("n_threads_batch", n_threads))
+            options["draft_model"] = draft
+        model = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, **options)
+        if draft is not None:
+            draft.check_vocab(model)
+        return model
+
+    def create_embedder(self, model_path: str, n_ctx: int, n_threads: int) -> Model:
+        from llama_cpp import Llama
+
+        return Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_threads_batch=n_threads,
+            embedding=True,
+            pooling_type=1,  # mean; most chat models define no pooling
+            verbose=False,
+        )
+
+    def create_batch_context(self, model: Model, n_seq: int, n_ctx: int):
+        """A context with n_seq sequences over model's weights, for batch_engine.BatchEngine"""
+        from batch_engine import LlamaBatchContext
+
+        return LlamaBatchContext(model, n_seq, n_ctx)
+
+    def state_type(self):
+        """Class of model.save_state() results, for rebuilding saved states"""
+        from llama_cpp import LlamaState
+
+        return LlamaState
+
+    def load_grammar(self, grammar: str):
+        """"json" or a GBNF file as a grammar to pass to the model's completions"""
+        from llama_cpp import LlamaGrammar
+        from llama_cpp.llama_grammar import JSON_GBNF
+
+        if grammar == "json":
+            return LlamaGrammar.from_string(JSON_GBNF, verbose=False)
+        return LlamaGrammar.from_file(grammar, verbose=False)
+
+
+class StubBackend:
+    """The simulated model of stub_llama.py.
+
+    Profile keys prefill_ms_per_token, decode_ms_per_token and answer_tokens
+    set its latency and answer length; with both latencies at 0 it answers
+    as fast as the rest of the pipeline allows.
+    """
+
+    name = "stub"
+    memory_planning = False
+
+    def create_model(self, model_path: str, n_ctx: int, n_threads: int, draft_model_path: str = None,
+                     draft_tokens: int = 8, **options) -> Model:
+        from stub_llama import StubLlama
+
+        return StubLlama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, **options)
+
+    def create_embedder(self, model_path: str, n_ctx: int, n_threads: int) -> Model:
+        from stub_llama import StubLlama
+
+        return StubLlama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads)
+
+    def create_batch_context(self, model: Model, n_seq: int, n_ctx: int):
+        from stub_llama import StubBatchContext
+
+        return StubBatchContext(model, n_seq, n_ctx)
+
+    def state_type(self):
+        from stub_llama import StubState
+
+        return StubState
+
+    def load_grammar(self, grammar: str):
+        # The stub's answers are fixed, so there is nothing to constrain
+        return None
+
+
+BACKENDS = {"llama_cpp": LlamaCppBackend, "stub": StubBackend}
+
+
+def get_backend(name: str):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
@@ -0,0 +1,167 @@
+"""Answer questions from a JSONL file without the GUI.
+
+Each input line is either a JSON string or an object with a "question" field
+and an optional "id". Answers are appended to the output file one JSON line
+per question as soon as they are ready, so an interrupted run picks up where
+it stopped when started again with the same output file. A question that
+fails (e.g. one too long for the context) gets a line with an "error"
+instead of an answer and counts as done.
+
+    python batch.py questions.jsonl -o answers.jsonl
+    python batch.py questions.jsonl -o answers.jsonl --workers 4 --threads 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from ai_agent import get_answer_details, load_model
+
+REPORT_EVERY = 10.0  # seconds
+
+
+def read_questions(path: str):
+    """Yield (id, question) pairs; ids default to the 1-based line number"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                yield str(line_no), item
+            else:
+                yield str(item.get("id", line_no)), item["question"]
+
+
+def completed_ids(path: str) -> set:
+    """Return the ids already answered in path, dropping a partly written last line"""
+    if not os.path.exists(path):
+        return set()
+
+    done = set()
+    valid_end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                break
+            valid_end += len(line)
+    with open(path, "r+b") as f:
+        f.truncate(valid_end)
+    return done
+
+
+class Throughput:
+    """Running totals for requests and generated tokens"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.cached = 0
+        self.tokens = 0
+        self.errors = 0
+
+    def add(self, result: dict):
+        self.requests += 1
+        self.cached += result["cached"]
+        self.tokens += result["completion_tokens"]
+
+    def add_error(self):
+        self.errors += 1
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        return (
+            f"{self.requests} answered ({self.cached} cached, {self.errors} failed) in {elapsed:.1f}s: "
+            f"{self.requests / elapsed if elapsed else 0:.2f} req/s, "
+            f"{self.tokens / elapsed if elapsed else 0:.1f} tok/s"
+        )
+
+
+def pending_questions(input_path: str, done: set, limit: int = None):
+    """Yield the (id, question) pairs that still need an answer"""
+    count = 0
+    for question_id, question in read_questions(input_path):
+        if question_id in done:
+            continue
+        if limit is not None and count >= limit:
+            return
+        done.add(question_id)
+        count += 1
+        yield question_id, question
+
+
+def run(input_path: str, output_path: str, limit: int = None,
+        workers: int = 1, threads: int = None) -> Throughput:
+    done = completed_ids(output_path)
+    if done:
+        print(f"Resuming: {len(done)} questions already answered", file=sys.stderr)
+
+    pending = list(pending_questions(input_path, done, limit))
+    # The model is loaded up front, so a model that fails to load stops the
+    # run instead of marking every question as failed
+    if workers > 1:
+        from worker_pool import WorkerPool
+
+        pool = WorkerPool(workers, threads)
+        pool.wait_ready()
+        results = pool.imap(question for _, question in pending)
+    else:
+        pool = None
+        load_model()
+        results = map(get_answer_details, (question for _, question in pending))
+
+    stats = Throughput()
+    last_report = time.perf_counter()
+    started = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out:
+        for question_id, question in pending:
+            # Both iterators carry on with the next question after one raises
+            try:
+                result = next(results)
+            except Exception as e:
+                record = {"id": question_id, "question": question, "error": str(e)}
+                stats.add_error()
+            else:
+                record = {
+                    "id": question_id,
+                    "question": question,
+                    "answer": result["answer"],
+                    "cached": result["cached"],
+                    "prompt_tokens": result["prompt_tokens"],
+                    "completion_tokens": result["completion_tokens"],
+                    "seconds": round(time.perf_counter() - started, 3),
+                }
+                stats.add(result)
+            started = time.perf_counter()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            if time.perf_counter() - last_report >= REPORT_EVERY:
+                print(stats.summary(), file=sys.stderr)
+                last_report = time.perf_counter()
+
+    if pool is not None:
+        pool.close()
+    print(stats.summary(), file=sys.stderr)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer questions from a JSONL file without the GUI")
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("-o", "--output", default="answers.jsonl", help="JSONL file answers are appended to")
+    parser.add_argument("--limit", type=int, help="stop after answering this many questions")
+    parser.add_argument("--workers", type=int, default=1, help="processes, each with its own copy of the model")
+    parser.add_argument("--threads", type=int, help="threads per worker process (default: cores / workers)")
+    args = parser.parse_args(argv)
+    run(args.input, args.output, args.limit, args.workers, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""Continuous batching: many conversations decoded together over one model.
+
+Each active request owns a KV-cache sequence slot. Every step builds one
+llama batch holding the next token of every sequence that is generating plus
+as much pending prompt as fits, so one forward pass advances all of them.
+Requests are admitted between steps as soon as a slot is free, and a slot is
+released the moment its sequence hits a stop string, EOS or max_tokens.
+
+The static part of the prompt (preamble and company info) is evaluated once
+and shared: its KV cells are copied into each new sequence, which with a
+unified KV cache only adds the sequence id to the existing cells.
+"""
+import collections
+import ctypes
+import queue
+import threading
+
+import numpy as np
+
+from stopping import Terminator
+
+# Shortest common prompt prefix worth sharing between sequences
+MIN_SHARED_PREFIX = 32
+
+
+def sample(logits: np.ndarray, rng: np.random.Generator, temperature: float = 0.8,
+           top_k: int = 40, top_p: float = 0.95, min_p: float = 0.05) -> int:
+    """Sample a token with the same sampler chain as Llama.__call__ (greedy at temperature 0)"""
+    if temperature <= 0:
+        return int(np.argmax(logits))
+    k = len(logits) if top_k <= 0 else min(top_k, len(logits))
+    candidates = np.argpartition(-logits, k - 1)[:k]
+    candidates = candidates[np.argsort(-logits[candidates])]
+    values = logits[candidates].astype(np.float64)
+
+    probs = np.exp(values - values[0])
+    probs /= probs.sum()
+    keep = int(np.searchsorted(np.cumsum(probs), top_p)) + 1
+    keep = min(keep, int(np.count_nonzero(probs >= min_p * probs[0])))
+    candidates, values = candidates[:max(1, keep)], values[:max(1, keep)]
+
+    probs = np.exp((values - values[0]) / temperature)
+    probs /= probs.sum()
+    return int(candidates[rng.choice(len(candidates), p=probs)])
+
+
+class Sequence:
+    """One request being generated in a slot"""
+
+    def __init__(self, prompt: list, max_tokens: int, stop: list, sampling: dict, seed):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.sampling = sampling
+        self.rng = np.random.default_rng(seed)
+        self.slot = None
+        self.n_past = 0
+        self.shared = 0
+        self.generated = []
+        self.buffer = b""
+        self.decoded = 0
+        self.terminator = Terminator(stop)
+        self.out = queue.Queue()
+        self.cancelled = False
+
+    @property
+    def prefilled(self) -> bool:
+        return self.n_past >= len(self.prompt)
+
+    def next_text(self, piece: bytes, final: bool) -> tuple:
+        """Add the bytes of a new token and return (text safe to emit, stop string hit)"""
+        self.buffer += piece
+        # An incomplete UTF-8 sequence at the end is left out until it completes
+        text = self.buffer.decode("utf-8", errors="ignore")
+        new, self.decoded = text[self.decoded:], len(text)
+        return self.terminator.feed(new, final)
+
+
+class SequenceStream:
+    """Iterator over the chunks of one sequence; close() cancels it"""
+
+    def __init__(self, sequence: Sequence):
+        self.sequence = sequence
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        if self.done:
+            raise StopIteration
+        item = self.sequence.out.get()
+        if item is None or isinstance(item, Exception):
+            self.done = True
+            if item is None:
+                raise StopIteration
+            raise item
+        return {"choices": [{"text": item, "index": 0, "finish_reason": None}]}
+
+    def close(self):
+        if not self.done:
+            self.sequence.cancelled = True
+            self.done = True
+
+
+class BatchEngine:
+    """Schedules sequences over a batch context on one engine thread.
+
+    context is a LlamaBatchContext (or the stub's equivalent) with n_slots
+    sequence slots plus one for the shared prefix.
+    """
+
+    def __init__(self, context, n_slots: int, n_batch: int, n_ctx_per_slot: int):
+        self.context = context
+        self.n_slots = n_slots
+        self.n_batch = n_batch
+        self.n_ctx_per_slot = n_ctx_per_slot
+        self.prefix_slot = n_slots
+        self.prefix = []
+        self.waiting = collections.deque()
+        self.active = []
+        self.free = list(range(n_slots - 1, -1, -1))
+        self.steps = 0
+        self.tokens = 0
+        self.shared_tokens = 0
+        self._closed = False
+        self._stale_prefix = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="batch-engine", daemon=True)
+        self._thread.start()
+
+    def stream(self, tokens: list, max_tokens: int = 16, stop=None, temperature: float = 0.8,
+               top_k: int = 40, top_p: float = 0.95, min_p: float = 0.05, seed=None, **kwargs):
+        """Generate from prompt tokens, yielding chunks shaped like Llama's stream=True output"""
+        if len(tokens) + max_tokens > self.n_ctx_per_slot:
+            raise ValueError(
+                f"Requested tokens ({len(tokens) + max_tokens}) exceed context window of {self.n_ctx_per_slot}"
+            )
+        stop = [stop] if isinstance(stop, str) else list(stop or [])
+        sampling = {"temperature": temperature, "top_k": top_k, "top_p": top_p, "min_p": min_p}
+        sequence = Sequence(list(tokens), max_tokens, stop, sampling, seed)
+        with self._cond:
+            self.waiting.append(sequence)
+            self._cond.notify()
+        return SequenceStream(sequence)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "slots": self.n_slots,
+                "active": len(self.active),
+                "waiting": len(self.waiting),
+                "steps": self.steps,
+                "tokens": self.tokens,
+                "shared_prefix_tokens": self.shared_tokens,
+            }
+
+    def invalidate_prefix(self):
+        """Stop sharing the current prefix, e.g. after the company info changed"""
+        with self._cond:
+            self._stale_prefix = True
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self.active and not self.waiting:
+                    self._cond.wait()
+                if self._closed:
+                    break
+                if self._stale_prefix:
+                    self.context.seq_rm(self.prefix_slot)
+                    self.prefix = []
+                    self._stale_prefix = False
+                while self.waiting and self.free:
+                    self._admit(self.waiting.popleft())
+            for sequence in [s for s in self.active if s.cancelled]:
+                self._finish(sequence)
+            if not self.active:
+                continue
+            try:
+                self._step()
+            except Exception as e:
+                for sequence in list(self.active):
+                    self._finish(sequence, e)
+        for sequence in list(self.active) + list(self.waiting):
+            sequence.out.put(RuntimeError("The inference engine was stopped"))
+
+    def _admit(self, sequence: Sequence):
+        """Give sequence a free slot. Must be called with _cond held, like all changes to active"""
+        if sequence.cancelled:
+            sequence.out.put(None)
+            return
+        sequence.slot = self.free.pop()
+        self.active.append(sequence)
+        shared = 0
+        for a, b in zip(sequence.prompt, self.prefix):
+            if a != b:
+                break
+            shared += 1
+        if shared >= MIN_SHARED_PREFIX:
+            # At least one prompt token must be evaluated to get logits
+            shared = min(shared, len(sequence.prompt) - 1)
+            self.context.seq_cp(self.prefix_slot, sequence.slot, 0, shared)
+            sequence.n_past = sequence.shared = shared
+            self.shared_tokens += shared
+
+    def _finish(self, sequence: Sequence, error: Exception = None):
+        self.context.seq_rm(sequence.slot)
+        with self._cond:
+            self.active.remove(sequence)
+            self.free.append(sequence.slot)
+        sequence.out.put(error)
+
+    def _step(self):
+        entries = []  # (token, position, slot, wants logits)
+        outputs = []  # sequence for each entry that wants logits
+        budget = self.n_batch
+        decoding = [sequence for sequence in self.active if sequence.prefilled]
+        for sequence in decoding:
+            entries.append((sequence.generated[-1], sequence.n_past, sequence.slot, True))
+            outputs.append(sequence)
+        budget -= len(decoding)
+        prefilling = []
+        for sequence in self.active:
+            if sequence.prefilled or budget <= 0:
+                continue
+            chunk = sequence.prompt[sequence.n_past:sequence.n_past + budget]
+            for i, token in enumerate(chunk):
+                last = sequence.n_past + i == len(sequence.prompt) - 1
+                entries.append((token, sequence.n_past + i, sequence.slot, last))
+                if last:
+                    outputs.append(sequence)
+            prefilling.append((sequence, len(chunk)))
+            budget -= len(chunk)
+
+        logits = self.context.decode(entries)
+        self.steps += 1
+        for sequence in decoding:
+            sequence.n_past += 1
+        for sequence, count in prefilling:
+            sequence.n_past += count
+            if sequence.prefilled and sequence.shared < max(MIN_SHARED_PREFIX, len(self.prefix) // 2):
+                # Little of the prefix was shared (prompts have moved on, e.g.
+                # to new company info): its prompt becomes the prefix for the
+                # sequences that follow
+                self._share_prefix(sequence)
+
+        for sequence, row in zip(outputs, logits):
+            if sequence.cancelled:
+                continue
+            token = sample(row, sequence.rng, **sequence.sampling)
+            sequence.generated.append(token)
+            self.tokens += 1
+            eog = self.context.is_eog(token)
+            final = eog or len(sequence.generated) >= sequence.max_tokens
+            piece = b"" if eog else self.context.token_bytes(token)
+            text, stopped = sequence.next_text(piece, final)
+            if text:
+                sequence.out.put(text)
+            if final or stopped:
+                self._finish(sequence)
+
+    def _share_prefix(self, sequence: Sequence):
+        """Keep the prompt of sequence so later prompts starting the same way can reuse it"""
+        self.context.seq_rm(self.prefix_slot)
+        self.context.seq_cp(sequence.slot, self.prefix_slot, 0, len(sequence.prompt))
+        self.prefix = list(sequence.prompt)
+
+
+class LlamaBatchContext:
+    """A second llama.cpp context over an already loaded Llama's weights, with n_seq slots.
+
+    The KV cache is unified, so its n_ctx is shared by all sequences and the
+    prefix cells copied between them are stored once.
+    """
+
+    def __init__(self, llm, n_seq: int, n_ctx: int):
+        from llama_cpp import _internals, llama_cpp
+
+        self._llama_cpp = llama_cpp
+        self.llm = llm
+        params = llama_cpp.llama_context_params.from_buffer_copy(llm.context_params)
+        params.n_ctx = n_ctx
+        params.n_seq_max = n_seq
+        params.kv_unified = True
+        self.n_batch = params.n_batch
+        self.n_vocab = llm.n_vocab()
+        self.ctx = _internals.LlamaContext(model=llm._model, params=params, verbose=False)
+        self.batch = _internals.LlamaBatch(n_tokens=self.n_batch, embd=0, n_seq_max=1, verbose=False)
+        self._vocab = llama_cpp.llama_model_get_vocab(llm._model.model)
+
+    def decode(self, entries: list) -> list:
+        """Evaluate (token, position, seq, wants logits) entries and return the requested logits rows"""
+        batch = self.batch.batch
+        batch.n_tokens = len(entries)
+        for i, (token, position, seq, logits) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = position
+            batch.seq_id[i][0] = seq
+            batch.n_seq_id[i] = 1
+            batch.logits[i] = logits
+        self.ctx.decode(self.batch)
+        rows = []
+        for i, entry in enumerate(entries):
+            if entry[3]:
+                pointer = self.ctx.get_logits_ith(i)
+                rows.append(np.ctypeslib.as_array(
+                    ctypes.cast(pointer, ctypes.POINTER(ctypes.c_float)), shape=(self.n_vocab,)
+                ).copy())
+        return rows
+
+    def seq_rm(self, seq: int):
+        self.ctx.kv_cache_seq_rm(seq, -1, -1)
+
+    def seq_cp(self, src: int, dst: int, p0: int, p1: int):
+        self.ctx.kv_cache_seq_cp(src, dst, p0, p1)
+
+    def is_eog(self, token: int) -> bool:
+        return bool(self._llama_cpp.llama_vocab_is_eog(self._vocab, token))
+
+    def token_bytes(self, token: int) -> bytes:
+        return self.llm.detokenize([token])
@@ -0,0 +1,287 @@
+"""Reproducible benchmark of the ai_agent inference path.
+
+Runs a fixed question set through build_prompt and get_answer for every point
+of a parameter grid and writes the results as JSON, so two runs (before and
+after a change) can be compared:
+
+    python benchmark.py -o before.json --n-ctx 1024 2048 --threads 4 8
+    python benchmark.py -o after.json --n-ctx 1024 2048 --threads 4 8
+    python benchmark.py --compare before.json after.json
+
+Every grid point runs in a fresh process, so cold start and peak RSS are
+measured from scratch. --stub swaps in the simulated model from
+stub_llama.py, which needs no model file and runs offline.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Fixed question set used unless --questions is given
+QUESTIONS = [
+    "What are your opening hours?",
+    "How can I contact customer support?",
+    "Where is the company based?",
+    "What products do you sell?",
+    "Do you offer refunds?",
+    "How long does shipping take?",
+    "Can I change my order after placing it?",
+    "Do you have a loyalty program?",
+]
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED = {
+    "cold_start": False,
+    "build_prompt": False,
+    "prepare_prompt_p50": False,
+    "ttft_p50": False,
+    "ttft_p95": False,
+    "decode_tokens_per_s": True,
+    "draft_acceptance": True,
+    "tokens_saved": True,
+    "latency_p50": False,
+    "latency_p95": False,
+    "latency_p99": False,
+    "peak_rss_mb": False,
+}
+
+
+def percentile(values: list, p: float):
+    """Nearest-rank percentile of values, or None when there are none"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it can't be read"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_point(point: dict, questions: list, repeats: int, warmup: int, stub: bool) -> dict:
+    """Benchmark one grid point. Runs in its own process."""
+    import ai_agent
+    from answer_cache import AnswerCache
+    from metrics import MetricsLog
+    from semantic_cache import SemanticCache
+
+    # Keep the benchmark's answers and metrics out of the user's cache and log
+    scratch = tempfile.mkdtemp(prefix="benchmark-")
+    ai_agent.answer_cache = AnswerCache(os.path.join(scratch, "answer_cache.sqlite3"))
+    ai_agent.semantic_cache = SemanticCache(ai_agent.SEMANTIC_THRESHOLD, ai_agent.SEMANTIC_MAX_BYTES,
+                                            ai_agent.SEMANTIC_BACKEND)
+    ai_agent.metrics_log = MetricsLog(os.path.join(scratch, "metrics.jsonl"))
+    try:
+        return _run_point(point, questions, repeats, warmup, stub)
+    finally:
+        ai_agent.answer_cache.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _run_point(point: dict, questions: list, repeats: int, warmup: int, stub: bool) -> dict:
+    import ai_agent
+
+    if stub:
+        ai_agent.MODEL_BACKEND = "stub"
+    if point.get("model"):
+        ai_agent.MODEL_PATH = point["model"]
+    # Measure the grid point as given, not what the memory planner would pick,
+    # and without model states saved by an earlier run
+    ai_agent.PLAN_MEMORY = False
+    ai_agent.session_store = None
+    ai_agent.N_CTX = point["n_ctx"]
+    ai_agent.N_THREADS = point["n_threads"]
+    ai_agent.MODEL_OPTIONS.pop("n_threads_batch", None)
+    ai_agent.GENERATION_PARAMS["max_tokens"] = point["max_tokens"]
+
+    start = time.perf_counter()
+    ai_agent.load_model()
+    cold_start = time.perf_counter() - start
+
+    info = ai_agent.knowledge_base.text
+    start = time.perf_counter()
+    for question in questions:
+        ai_agent.build_prompt(question, info)
+    build_prompt = (time.perf_counter() - start) / len(questions)
+
+    for question in questions[:warmup]:
+        ai_agent.get_answer_details(question, use_cache=False)
+
+    records = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for question in questions:
+            records.append(ai_agent.get_answer_details(question, use_cache=False)["metrics"])
+    elapsed = time.perf_counter() - start
+
+    def values(key):
+        return [r[key] for r in records if r[key] is not None]
+
+    def rounded(value, digits=4):
+        return round(value, digits) if value is not None else None
+
+    decode = values("decode_tokens_per_s")
+    latency = values("total")
+    ttft = values("ttft")
+    acceptance = values("draft_acceptance")
+    completion_tokens = sum(r["completion_tokens"] for r in records)
+    return {
+        **point,
+        "requests": len(records),
+        "prompt_tokens_mean": rounded(statistics.mean(r["prompt_tokens"] for r in records), 1),
+        "completion_tokens": completion_tokens,
+        "cold_start": rounded(cold_start),
+        "build_prompt": rounded(build_prompt, 6),
+        "prepare_prompt_p50": rounded(percentile(values("prompt_build"), 50), 6),
+        "ttft_p50": rounded(percentile(ttft, 50)),
+        "ttft_p95": rounded(percentile(ttft, 95)),
+        "decode_tokens_per_s": rounded(statistics.median(decode), 2) if decode else None,
+        "draft_acceptance": rounded(statistics.mean(acceptance), 3) if acceptance else None,
+        "latency_p50": rounded(percentile(latency, 50)),
+        "latency_p95": rounded(percentile(latency, 95)),
+        "latency_p99": rounded(percentile(latency, 99)),
+        "tok_per_s": rounded(completion_tokens / elapsed, 1),
+        "tokens_saved": sum(r["tokens_saved"] for r in records),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def grid(args) -> list:
+    models = args.model or [None]
+    return [
+        {"model": model, "n_ctx": n_ctx, "n_threads": n_threads, "max_tokens": max_tokens}
+        for model, n_ctx, n_threads, max_tokens in itertools.product(
+            models, args.n_ctx, args.threads, args.max_tokens)
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(args, questions: list) -> dict:
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "backend": "stub" if args.stub else "llama_cpp",
+        "questions": len(questions),
+        "repeats": args.repeats,
+        "warmup": args.warmup,
+    }
+
+
+def benchmark(args, questions: list) -> dict:
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for point in grid(args):
+        # A fresh process per point, so the model load is a real cold start
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            result = pool.apply(run_point, (point, questions, args.repeats, args.warmup, args.stub))
+        print(
+            f"n_ctx={point['n_ctx']:<5} threads={point['n_threads']:<3} max_tokens={point['max_tokens']:<4} "
+            f"load {result['cold_start']:.2f}s, ttft p50 {result['ttft_p50']}s, "
+            f"{result['decode_tokens_per_s']} tok/s, latency p50/p95/p99 "
+            f"{result['latency_p50']}/{result['latency_p95']}/{result['latency_p99']}s, "
+            f"peak RSS {result['peak_rss_mb']} MB"
+        )
+        results.append(result)
+    return {"environment": environment(args, questions), "results": results}
+
+
+def point_key(result: dict) -> tuple:
+    return result.get("model"), result["n_ctx"], result["n_threads"], result["max_tokens"]
+
+
+def compare(old: dict, new: dict) -> list:
+    """Relative change of every compared metric for grid points present in both runs"""
+    old_results = {point_key(r): r for r in old["results"]}
+    rows = []
+    for result in new["results"]:
+        before = old_results.get(point_key(result))
+        if before is None:
+            continue
+        for name, higher_is_better in COMPARED.items():
+            a, b = before.get(name), result.get(name)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            rows.append({
+                "point": point_key(result),
+                "metric": name,
+                "old": a,
+                "new": b,
+                "change": round(change, 4),
+                "better": change > 0 if higher_is_better else change < 0,
+            })
+    return rows
+
+
+def print_comparison(rows: list):
+    for row in rows:
+        model, n_ctx, n_threads, max_tokens = row["point"]
+        label = f"n_ctx={n_ctx} threads={n_threads} max_tokens={max_tokens}"
+        if model:
+            label = f"{os.path.basename(model)} {label}"
+        verdict = "better" if row["better"] else "worse" if row["change"] else "same"
+        print(f"{label:<48} {row['metric']:<20} {row['old']:>10} -> {row['new']:<10} "
+              f"{row['change']:+.1%} {verdict}")
+
+
+def main(argv=None):
+    from batch import read_questions
+
+    parser = argparse.ArgumentParser(description="Benchmark the inference path over a parameter grid")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file to write the results to")
+    parser.add_argument("--questions", help="JSONL file of questions (same format as batch.py)")
+    parser.add_argument("--model", nargs="+", help="model files to compare (default: ai_agent.MODEL_PATH)")
+    parser.add_argument("--n-ctx", nargs="+", type=int, default=[2048])
+    parser.add_argument("--threads", nargs="+", type=int, default=[6])
+    parser.add_argument("--max-tokens", nargs="+", type=int, default=[200])
+    parser.add_argument("--repeats", type=int, default=3, help="times each question is asked")
+    parser.add_argument("--warmup", type=int, default=2, help="questions answered before measuring")
+    parser.add_argument("--stub", action="store_true", help="use the simulated model from stub_llama.py")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        print_comparison(compare(old, new))
+        return
+
+    questions = [q for _, q in read_questions(args.questions)] if args.questions else QUESTIONS
+    results = benchmark(args, questions)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import datetime
+import tkinter as tk
+
+# Most messages kept in the Text widget at once
+WINDOW_MESSAGES = 200
+# Messages paged in (or out) at a time when scrolling past the window
+PAGE_MESSAGES = 50
+
+
+class ChatTranscript:
+    """Chat messages shown in a ScrolledText through a bounded window.
+
+    Every message is kept in a plain list; only messages[first:last] are in the
+    widget. Appending trims the oldest messages from the top once the window is
+    full, and scrolling to either edge pages more messages in from the list, so
+    the widget (and the cost of inserts, scrolling and retagging) stays the
+    same size however long the conversation gets.
+    """
+
+    def __init__(self, chat_box):
+        self.chat_box = chat_box
+        self.messages = []  # (header, body, role)
+        self.first = 0
+        self.last = 0
+        self.streaming = False
+        self._paging = False
+        chat_box.configure(yscrollcommand=self._on_yscroll)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def _segments(self, index: int) -> list:
+        """Text and tag arguments for Text.insert for one message"""
+        header, body, role = self.messages[index]
+        segments = [header, "timestamp"] if header else []
+        segments += [body, role]
+        if not (self.streaming and index == len(self.messages) - 1):
+            segments += ["\n\n", role]
+        return segments
+
+    def _lines(self, index: int) -> int:
+        header, body, _ = self.messages[index]
+        return (header or "").count("\n") + body.count("\n") + 2
+
+    def _line_of(self, index: int) -> int:
+        """Widget line where message index starts"""
+        return 1 + sum(self._lines(i) for i in range(self.first, index))
+
+    def _insert(self, where: str, start: int, end: int):
+        segments = []
+        for index in range(start, end):
+            segments += self._segments(index)
+        if segments:
+            self.chat_box.insert(where, *segments)
+
+    def _edit(self, action, *args):
+        self.chat_box.config(state=tk.NORMAL)
+        try:
+            action(*args)
+        finally:
+            self.chat_box.config(state=tk.DISABLED)
+
+    def at_tail(self) -> bool:
+        return self.last == len(self.messages)
+
+    def add(self, speaker: str, body: str, role: str = "assistant", show_timestamp: bool = True):
+        """Append a complete message and scroll to it"""
+        header = None
+        if show_timestamp:
+            timestamp = datetime.datetime.now().strftime("%H:%M")
+            header = f"[{timestamp}] {speaker}:\n"
+        self._append((header, body, role))
+
+    def begin_stream(self, role: str = "assistant"):
+        """Start a message whose text arrives through append_stream"""
+        self.streaming = True
+        self._append((None, "", role))
+
+    def append_stream(self, text: str):
+        header, body, role = self.messages[-1]
+        self.messages[-1] = (header, body + text, role)
+        if self.at_tail():
+            self._edit(self.chat_box.insert, tk.END + "-1c", text, role)
+            self.chat_box.see(tk.END)
+
+    def end_stream(self):
+        if not self.streaming:
+            return
+        self.streaming = False
+        role = self.messages[-1][2]
+        if self.at_tail():
+            self._edit(self.chat_box.insert, tk.END + "-1c", "\n\n", role)
+            self._edit(self._trim_top)
+            self.chat_box.see(tk.END)
+
+    def _append(self, message):
+        was_at_tail = self.at_tail()
+        self.messages.append(message)
+        if was_at_tail:
+            self._edit(self._insert, tk.END + "-1c", len(self.messages) - 1, len(self.messages))
+            self.last = len(self.messages)
+            self._edit(self._trim_top)
+        else:
+            self._edit(self._render_tail)
+        self.chat_box.see(tk.END)
+        # Auto-scroll to bottom
+        self.chat_box.after(1, lambda: self.chat_box.see(tk.END))
+
+    def clear(self):
+        self.messages = []
+        self.first = self.last = 0
+        self.streaming = False
+        self._edit(self.chat_box.delete, "1.0", tk.END)
+
+    def _render_tail(self):
+        """Replace the widget content with the newest WINDOW_MESSAGES messages"""
+        self.chat_box.delete("1.0", tk.END)
+        self.first = max(0, len(self.messages) - WINDOW_MESSAGES)
+        self.last = len(self.messages)
+        self._insert(tk.END, self.first, self.last)
+
+    def _trim_top(self):
+        excess = self.last - self.first - WINDOW_MESSAGES
+        if excess > 0:
+            self.chat_box.delete("1.0", f"{self._line_of(self.first + excess)}.0")
+            self.first += excess
+
+    def _trim_bottom(self):
+        excess = self.last - self.first - WINDOW_MESSAGES
+        if excess > 0 and not self.streaming:
+            self.chat_box.delete(f"{self._line_of(self.last - excess)}.0", tk.END + "-1c")
+            self.last -= excess
+
+    def page_older(self):
+        """Bring the previous PAGE_MESSAGES messages into the top of the window"""
+        count = min(PAGE_MESSAGES, self.first)
+        if count:
+            start = self.first - count
+            self._edit(self._insert, "1.0", start, self.first)
+            self.first = start
+            self._edit(self._trim_bottom)
+            # Keep the message that was at the top in view
+            self.chat_box.yview(f"{self._line_of(start + count)}.0")
+        self._paging = False
+
+    def page_newer(self):
+        """Bring the next PAGE_MESSAGES messages into the bottom of the window"""
+        count = min(PAGE_MESSAGES, len(self.messages) - self.last)
+        if count:
+            anchor = self.last
+            self._edit(self._insert, tk.END + "-1c", self.last, self.last + count)
+            self.last += count
+            self._edit(self._trim_top)
+            self.chat_box.see(f"{self._line_of(anchor)}.0")
+        self._paging = False
+
+    def _on_yscroll(self, first, last):
+        self.chat_box.vbar.set(first, last)
+        if self._paging:
+            return
+        if float(first) <= 0.0 and self.first > 0:
+            self._paging = True
+            self.chat_box.after_idle(self.page_older)
+        elif float(last) >= 1.0 and not self.at_tail():
+            self._paging = True
+            self.chat_box.after_idle(self.page_newer)
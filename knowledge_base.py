@@ -0,0 +1,500 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+# Passages are built from paragraphs and kept under this many characters
+CHUNK_CHARS = 800
+TOP_K = 8
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+INDEX_VERSION = 2
+
+# Files indexed when the knowledge source is a directory
+DOCUMENT_EXTENSIONS = (".txt", ".md", ".rst")
+# Seconds between checks for changed documents by KnowledgeBase.watch
+POLL_INTERVAL = 2.0
+_DOCUMENT_SEPARATOR = "\n\n"
+
+_TERM = re.compile(r"\w+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def tokenize_terms(text: str) -> list:
+    return _TERM.findall(text.lower())
+
+
+def split_chunks(text: str, max_chars: int = CHUNK_CHARS) -> list:
+    """Split text into passages and return their (start, end) character offsets.
+
+    Consecutive short paragraphs are merged and long paragraphs are cut at
+    sentence (or, failing that, whitespace) boundaries.
+    """
+    paragraphs = []
+    pos = 0
+    for match in list(_PARAGRAPH_BREAK.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        if text[pos:end].strip():
+            paragraphs.extend(_split_long(text, pos, end, max_chars))
+        if match:
+            pos = match.end()
+
+    chunks = []
+    for start, end in paragraphs:
+        if chunks and end - chunks[-1][0] <= max_chars:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+
+def _split_long(text: str, start: int, end: int, max_chars: int) -> list:
+    pieces = []
+    while end - start > max_chars:
+        window = text[start:start + max_chars]
+        cut = 0
+        for match in _SENTENCE_END.finditer(window):
+            cut = match.start()
+        if cut < max_chars // 2:
+            cut = window.rfind(" ")
+        if cut <= 0:
+            cut = max_chars
+        pieces.append((start, start + cut))
+        start += cut
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        pieces.append((start, end))
+    return pieces
+
+
+class Document:
+    """Passages and term postings of one source file.
+
+    term_ids index the vocabulary of the KnowledgeBase that built it and
+    chunk_ids count from 0 within the document, so a document is indexed once
+    and reused unchanged in every snapshot until its file changes.
+    """
+
+    def __init__(self, name, version, digest, text, chunks, term_ids, chunk_ids, tfs, doc_len):
+        self.name = name
+        self.version = version
+        self.digest = digest
+        self.text = text
+        self.chunks = chunks
+        self.term_ids = term_ids
+        self.chunk_ids = chunk_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+
+
+def index_document(name: str, version, digest: str, text: str, vocab: dict) -> Document:
+    """Chunk text and count the terms of every passage, adding new terms to vocab"""
+    chunks = split_chunks(text)
+    term_ids, chunk_ids, tfs = [], [], []
+    doc_len = np.zeros(len(chunks), dtype=np.float32)
+    for chunk, (start, end) in enumerate(chunks):
+        counts = {}
+        terms = tokenize_terms(text[start:end])
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        doc_len[chunk] = len(terms)
+        for term, tf in counts.items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            chunk_ids.append(chunk)
+            tfs.append(tf)
+
+    return Document(
+        name, version, digest, text,
+        chunks=np.asarray(chunks, dtype=np.int64).reshape(-1, 2),
+        term_ids=np.asarray(term_ids, dtype=np.int64),
+        chunk_ids=np.asarray(chunk_ids, dtype=np.int64),
+        tfs=np.asarray(tfs, dtype=np.float32),
+        doc_len=doc_len,
+    )
+
+
+class KnowledgeSnapshot:
+    """Immutable BM25 index over the passages of a set of documents.
+
+    Postings are stored in CSR layout: the passages containing term i are
+    doc_ids[indptr[i]:indptr[i + 1]]. Chunk offsets point into text, the
+    documents joined by blank lines.
+    """
+
+    def __init__(self, text="", digest="", documents=(), starts=(), chunks=None, terms=(),
+                 indptr=None, doc_ids=None, tfs=None, doc_len=None):
+        self.text = text
+        self.digest = digest
+        self.documents = tuple(documents)
+        # Where each document starts in text
+        self.starts = tuple(starts)
+        self.chunks = chunks if chunks is not None else np.zeros((0, 2), dtype=np.int64)
+        self.terms = list(terms)
+        self.vocab = {term: i for i, term in enumerate(self.terms)}
+        self.indptr = indptr if indptr is not None else np.zeros(1, dtype=np.int64)
+        self.doc_ids = doc_ids if doc_ids is not None else np.zeros(0, dtype=np.int32)
+        self.tfs = tfs if tfs is not None else np.zeros(0, dtype=np.float32)
+        self.doc_len = doc_len if doc_len is not None else np.zeros(0, dtype=np.float32)
+        self._full_fit = {}
+
+        n_docs = len(self.chunks)
+        doc_freq = np.diff(self.indptr).astype(np.float32)
+        self.idf = np.log(1.0 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_len = float(self.doc_len.mean()) if n_docs else 0.0
+        self.doc_norm = K1 * (1 - B + B * self.doc_len / (avg_len or 1.0))
+
+    @classmethod
+    def assemble(cls, documents: list, terms: list, digest: str) -> "KnowledgeSnapshot":
+        """Merge per-document postings into one index over the joined text"""
+        if not documents:
+            return cls(digest=digest)
+
+        starts, chunks, term_ids, doc_ids, tfs, doc_len = [], [], [], [], [], []
+        offset = 0
+        chunk_base = 0
+        for document in documents:
+            starts.append(offset)
+            chunks.append(document.chunks + offset)
+            term_ids.append(document.term_ids)
+            doc_ids.append(document.chunk_ids + chunk_base)
+            tfs.append(document.tfs)
+            doc_len.append(document.doc_len)
+            offset += len(document.text) + len(_DOCUMENT_SEPARATOR)
+            chunk_base += len(document.chunks)
+
+        # Keep only the terms that still occur, so removed documents don't
+        # leave their vocabulary behind
+        term_ids = np.concatenate(term_ids)
+        doc_ids = np.concatenate(doc_ids)
+        counts = np.bincount(term_ids, minlength=len(terms))
+        used = np.flatnonzero(counts)
+        remap = np.zeros(len(terms), dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        term_ids = remap[term_ids]
+        indptr = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(counts[used], out=indptr[1:])
+        # A term occurs once per passage, so (term, passage) keys are unique
+        # and an unstable sort gives the same order as a stable one
+        order = np.argsort(term_ids * chunk_base + doc_ids)
+
+        return cls(
+            text=_DOCUMENT_SEPARATOR.join(document.text for document in documents),
+            digest=digest,
+            documents=documents,
+            starts=starts,
+            chunks=np.concatenate(chunks),
+            terms=[terms[i] for i in used],
+            indptr=indptr,
+            doc_ids=doc_ids.astype(np.int32)[order],
+            tfs=np.concatenate(tfs)[order],
+            doc_len=np.concatenate(doc_len),
+        )
+
+    def chunk_text(self, doc: int) -> str:
+        start, end = self.chunks[doc]
+        return self.text[start:end]
+
+    def search(self, query: str, k: int = TOP_K) -> list:
+        """Return (doc, score) pairs for the k passages that best match query"""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term in set(tokenize_terms(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (K1 + 1) / (tf + self.doc_norm[docs])
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(doc), float(scores[doc])) for doc in top]
+
+    def fits_whole(self, budget: int, count_tokens) -> bool:
+        """Whether the whole knowledge text fits in budget tokens"""
+        if budget not in self._full_fit:
+            # No tokenizer averages more than ~8 characters per token, so
+            # anything longer cannot fit and is not worth tokenizing
+            self._full_fit[budget] = (
+                len(self.text) <= budget * 8 and count_tokens(self.text) <= budget
+            )
+        return self._full_fit[budget]
+
+    def context(self, query: str, budget: int, count_tokens, k: int = TOP_K):
+        """Return (info, is_whole_file) to put in the prompt for query.
+
+        The whole text is used when it fits in budget tokens, so the prompt
+        prefix stays static. Otherwise the best matching passages are added
+        until the budget is spent and returned in document order.
+        """
+        if self.fits_whole(budget, count_tokens):
+            return self.text, True
+
+        hits = [doc for doc, _ in self.search(query, k)]
+        if not hits:
+            hits = range(min(k, len(self.chunks)))
+
+        selected = []
+        remaining = budget
+        for doc in hits:
+            cost = count_tokens(self.chunk_text(doc) + "\n\n")
+            if cost <= remaining:
+                selected.append(doc)
+                remaining -= cost
+        return "\n\n".join(self.chunk_text(doc) for doc in sorted(selected)), False
+
+
+class StoredIndex:
+    """A snapshot index loaded from disk, before it is matched against the current files"""
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.digest = str(data["digest"])
+        names = str(data["doc_names"])
+        self.names = names.split("\n") if names else []
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.digests = dict(zip(self.names, str(data["doc_digests"]).split("\n")))
+        terms = str(data["terms"])
+        self.terms = terms.split("\n") if terms else []
+        self._postings = None
+
+    def snapshot(self, documents: list) -> KnowledgeSnapshot:
+        data = self.data
+        return KnowledgeSnapshot(
+            text=_DOCUMENT_SEPARATOR.join(document.text for document in documents),
+            digest=self.digest,
+            documents=documents,
+            starts=data["doc_starts"],
+            chunks=data["chunks"],
+            terms=self.terms,
+            indptr=data["indptr"],
+            doc_ids=data["doc_ids"],
+            tfs=data["tfs"],
+            doc_len=data["doc_len"],
+        )
+
+    def fill(self, document: Document, vocab: dict):
+        """Set the chunks and postings of document from its part of the index"""
+        data = self.data
+        if self._postings is None:
+            # Postings back in passage order, with terms mapped into vocab
+            term_map = np.array([vocab.setdefault(term, len(vocab)) for term in self.terms], dtype=np.int64)
+            term_ids = np.repeat(term_map, np.diff(data["indptr"]))
+            doc_ids = data["doc_ids"]
+            order = np.argsort(doc_ids)
+            chunk_bounds = np.concatenate(([0], np.cumsum(data["doc_chunks"])))
+            self._postings = (
+                term_ids[order], doc_ids[order].astype(np.int64), data["tfs"][order], chunk_bounds,
+                np.searchsorted(doc_ids[order], chunk_bounds),
+            )
+        term_ids, doc_ids, tfs, chunk_bounds, posting_bounds = self._postings
+
+        i = self.positions[document.name]
+        first, last = chunk_bounds[i], chunk_bounds[i + 1]
+        lo, hi = posting_bounds[i], posting_bounds[i + 1]
+        document.chunks = data["chunks"][first:last] - data["doc_starts"][i]
+        document.term_ids = term_ids[lo:hi]
+        document.chunk_ids = doc_ids[lo:hi] - first
+        document.tfs = tfs[lo:hi]
+        document.doc_len = data["doc_len"][first:last]
+
+
+class KnowledgeBase:
+    """Hot-reloadable knowledge from a single file or a directory of documents.
+
+    refresh() (or the watch() thread) re-reads only files whose size or
+    modification time changed, re-indexes only those whose content changed,
+    and replaces snapshot with a new KnowledgeSnapshot in one assignment.
+    Requests hold on to the snapshot they started with, so a reload never
+    pauses or disturbs them. Functions registered with on_change are called
+    with the new snapshot after every reload that changed the content.
+
+    The merged index is stored next to the source as NumPy arrays, so a
+    restart only re-indexes the documents that changed while it was down.
+    """
+
+    def __init__(self, path: str, index_path: str = None):
+        self.path = path
+        self.index_path = index_path or f"{path.rstrip(os.sep)}.index.npz"
+        self.snapshot = KnowledgeSnapshot()
+        self.documents = {}
+        self._versions = None
+        self._vocab = {}
+        # Documents whose postings are still only in a StoredIndex
+        self._pending = {}
+        self._listeners = []
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    @property
+    def text(self) -> str:
+        return self.snapshot.text
+
+    @property
+    def digest(self) -> str:
+        return self.snapshot.digest
+
+    def on_change(self, callback):
+        self._listeners.append(callback)
+
+    def sources(self) -> list:
+        """(name, path) of every document, in the order they are joined"""
+        if not os.path.isdir(self.path):
+            return [(os.path.basename(self.path), self.path)]
+        found = []
+        for root, dirs, files in os.walk(self.path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for file_name in files:
+                if file_name.startswith(".") or not file_name.lower().endswith(DOCUMENT_EXTENSIONS):
+                    continue
+                path = os.path.join(root, file_name)
+                found.append((os.path.relpath(path, self.path).replace(os.sep, "/"), path))
+        return sorted(found)
+
+    def _stat_sources(self) -> tuple:
+        versions = []
+        for name, path in self.sources():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if not os.path.isdir(self.path):
+                    raise
+                continue  # Deleted while listing
+            versions.append((name, path, (stat.st_mtime_ns, stat.st_size)))
+        return tuple(versions)
+
+    def refresh(self) -> bool:
+        """Reload changed documents and swap in a new snapshot. Returns True if the content changed."""
+        if self._stat_sources() == self._versions:
+            return False
+
+        with self._lock:
+            versions = self._stat_sources()
+            if versions == self._versions:
+                return False
+            first_load = self._versions is None
+            stored = self._load_index() if first_load else None
+
+            documents = {}
+            for name, path, version in versions:
+                document = self.documents.get(name)
+                if document is not None and document.version == version:
+                    documents[name] = document
+                    continue
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+                digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                if document is not None and document.digest == digest:
+                    document.version = version
+                elif stored is not None and stored.digests.get(name) == digest:
+                    # Postings are split out of the saved index only if needed
+                    document = Document(name, version, digest, text, None, None, None, None, None)
+                    self._pending[name] = stored
+                else:
+                    document = index_document(name, version, digest, text, self._vocab)
+                    self._pending.pop(name, None)
+                documents[name] = document
+
+            self.documents = documents
+            self._versions = versions
+            documents = list(documents.values())
+            digest = self._combined_digest(documents)
+            previous = self.snapshot
+            if digest == previous.digest:
+                return False
+            if stored is not None and digest == stored.digest:
+                # Unchanged since the index was saved: use it as is
+                self.snapshot = stored.snapshot(documents)
+            else:
+                self._split_pending(documents)
+                terms = [None] * len(self._vocab)
+                for term, term_id in self._vocab.items():
+                    terms[term_id] = term
+                self.snapshot = KnowledgeSnapshot.assemble(documents, terms, digest)
+                self._save_index()
+
+        if not first_load:
+            for callback in self._listeners:
+                callback(self.snapshot)
+        return True
+
+    def _combined_digest(self, documents: list) -> str:
+        if not os.path.isdir(self.path):
+            # The digest of the file itself, as before directories were supported
+            return documents[0].digest
+        listing = "\n".join(f"{document.name}\0{document.digest}" for document in documents)
+        return hashlib.sha256(listing.encode("utf-8")).hexdigest()
+
+    def watch(self, interval: float = POLL_INTERVAL):
+        """Check for changed documents every interval seconds on a daemon thread"""
+        if self._watcher is None:
+            self._watcher = threading.Thread(
+                target=self._watch, args=(interval,), name="knowledge-watcher", daemon=True
+            )
+            self._watcher.start()
+
+    def _watch(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except (OSError, UnicodeDecodeError) as e:
+                # Keep serving the last good snapshot, e.g. while a file is
+                # being replaced
+                logging.getLogger(__name__).warning("Knowledge base reload failed: %s", e)
+
+    def _save_index(self):
+        snapshot = self.snapshot
+        tmp_path = f"{self.index_path}.tmp.npz"
+        try:
+            np.savez(
+                tmp_path,
+                index_version=np.array(INDEX_VERSION),
+                digest=np.array(snapshot.digest),
+                chunk_chars=np.array(CHUNK_CHARS),
+                # Names and terms never contain newlines, so one joined string
+                # is the most compact way to store them without pickling
+                doc_names=np.array("\n".join(d.name for d in snapshot.documents)),
+                doc_digests=np.array("\n".join(d.digest for d in snapshot.documents)),
+                doc_starts=np.array(snapshot.starts, dtype=np.int64),
+                doc_chunks=np.array([len(d.chunks) for d in snapshot.documents], dtype=np.int64).reshape(-1),
+                chunks=snapshot.chunks,
+                terms=np.array("\n".join(snapshot.terms)),
+                indptr=snapshot.indptr,
+                doc_ids=snapshot.doc_ids,
+                tfs=snapshot.tfs,
+                doc_len=snapshot.doc_len,
+            )
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # A read-only location only costs a rebuild on the next start
+            pass
+
+    def _load_index(self):
+        try:
+            with np.load(self.index_path, allow_pickle=False) as data:
+                if int(data["index_version"]) != INDEX_VERSION or int(data["chunk_chars"]) != CHUNK_CHARS:
+                    return None
+                return StoredIndex({name: data[name] for name in data.files})
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _split_pending(self, documents: list):
+        """Fill in the postings of documents that were taken from the saved index"""
+        for document in documents:
+            stored = self._pending.pop(document.name, None)
+            if stored is not None:
+                stored.fill(document, self._vocab)
+        self._pending.clear()
@@ -4,10 +4,18 @@ import sys
 import os
 import threading
 import time
-from ai_agent import get_answer
+import queue
+from ai_agent import stream_answer, load_model_async, metrics_log, load_conversation, save_conversation
+from chat_transcript import ChatTranscript
+from style_registry import StyleRegistry
 
 
 class ChatApp:
+    # How often streamed tokens are flushed into the chat box
+    stream_flush_ms = 50
+    # Quiet time after the last +/- click before fonts and padding are redone
+    scaling_delay_ms = 150
+
     def __init__(self, root):
         self.root = root
         self.root.title("My Custom AI Assistant")
@@ -27,6 +35,18 @@ class ChatApp:
         self.is_processing = False  # Add processing state
         self.conversation_history = []  # Store conversation history
 
+        # Streaming state: worker thread puts text chunks, Tk timer drains them
+        self.stream_queue = queue.Queue()
+        self.stream_text = []
+        self.stream_discarded = False
+        self.cancel_event = threading.Event()
+        self.answering = None  # User message the current answer belongs to
+
+        # Model loads in the background; input is queued until it is ready
+        self.model_ready = False
+        self.model_loading = False
+        self.pending_inputs = []
+
         # Improved color scheme with better contrast
         self.colors = {
             True: {
@@ -61,15 +81,47 @@ class ChatApp:
             }
         }
 
+        # Widget options that follow theme, scale and processing state
+        self.styles = StyleRegistry()
+        self.scaling_job = None
+
         self.create_widgets()
+        self.setup_styles()
         self.configure_theme()
+        self.restore_conversation()
 
         # Bind resize event to maintain proper scaling
         self.root.bind('<Configure>', self.on_window_resize)
 
+        # Escape stops the answer being generated
+        self.root.bind('<Escape>', self.cancel_response)
+
+        # F12 cycles request profiling (off, cProfile, tracemalloc)
+        self.root.bind('<F12>', self.toggle_profiling)
+
         # Set focus to input field
         self.entry.focus_set()
 
+        self.start_model_loading()
+
+    def start_model_loading(self):
+        """Load the model on a background thread so the window paints immediately"""
+        self.model_loading = True
+        self.status_label.config(text="Loading model...")
+        load_model_async(lambda error: self.root.after(0, self.on_model_loaded, error))
+
+    def on_model_loaded(self, error=None):
+        """Handle the end of model loading (called from main thread)"""
+        self.model_loading = False
+        if error is not None:
+            self.pending_inputs.clear()
+            self.display_response(f"Sorry, the model failed to load: {str(error)}", True)
+            self.status_label.config(text="Model failed to load")
+            return
+
+        self.model_ready = True
+        self.start_next_pending()
+
     def setup_high_dpi(self):
         """Enable high DPI awareness for Windows"""
         try:
@@ -108,55 +160,121 @@ class ChatApp:
     def increase_scale(self):
         """Increase UI scale factor"""
         self.scale_factor = min(self.scale_factor + 0.1, 3.0)
-        self.update_scaling()
+        self.schedule_scaling()
 
     def decrease_scale(self):
         """Decrease UI scale factor"""
         self.scale_factor = max(self.scale_factor - 0.1, 0.8)
-        self.update_scaling()
+        self.schedule_scaling()
+
+    def schedule_scaling(self):
+        """Merge quick +/- clicks into one relayout once the clicking stops"""
+        self.scale_label.config(text=f"{self.scale_factor:.1f}x")
+        if self.scaling_job is not None:
+            self.root.after_cancel(self.scaling_job)
+        self.scaling_job = self.root.after(self.scaling_delay_ms, self.update_scaling)
 
     def update_scaling(self):
         """Update all UI elements with new scale factor"""
-        # Update fonts for all widgets
-        self.title_label.config(font=self.get_scaled_font("Segoe UI", 16, "bold"))
-        self.toggle_btn.config(font=self.get_scaled_font("Segoe UI", 9))
-        self.scale_down_btn.config(font=self.get_scaled_font("Segoe UI", 10, "bold"))
-        self.scale_up_btn.config(font=self.get_scaled_font("Segoe UI", 10, "bold"))
-        self.scale_label.config(font=self.get_scaled_font("Segoe UI", 9))
-        self.chat_box.config(font=self.get_scaled_font("Segoe UI", 11))
-        self.entry.config(font=self.get_scaled_font("Segoe UI", 11))
-        self.send_btn.config(font=self.get_scaled_font("Segoe UI", 10, "bold"))
-        self.clear_btn.config(font=self.get_scaled_font("Segoe UI", 10, "bold"))
-        self.status_label.config(font=self.get_scaled_font("Segoe UI", 9))
-
-        # Update padding and spacing
-        self.main_frame.pack_configure(padx=int(20 * self.scale_factor), pady=int(20 * self.scale_factor))
-        self.chat_box.config(
-            padx=int(20 * self.scale_factor),
-            pady=int(15 * self.scale_factor),
-            spacing1=int(5 * self.scale_factor),
-            spacing2=int(3 * self.scale_factor),
-            spacing3=int(10 * self.scale_factor)
-        )
-        self.entry.config(
-            padx=int(15 * self.scale_factor),
-            pady=int(10 * self.scale_factor)
-        )
-        self.send_btn.config(
-            padx=int(20 * self.scale_factor),
-            pady=int(10 * self.scale_factor)
-        )
-        self.clear_btn.config(
-            padx=int(15 * self.scale_factor),
-            pady=int(8 * self.scale_factor)
-        )
-        self.toggle_btn.config(
-            padx=int(15 * self.scale_factor),
-            pady=int(8 * self.scale_factor)
-        )
+        self.scaling_job = None
+        self.styles.apply("scale")
+
+    def color(self, key):
+        """Style resolver for a color of the current theme"""
+        return lambda: self.colors[self.is_dark][key]
+
+    def scaled(self, size):
+        """Style resolver for a size in pixels at the current scale"""
+        return lambda: int(size * self.scale_factor)
+
+    def font(self, family, size, weight="normal"):
+        """Style resolver for a font at the current scale"""
+        return lambda: self.get_scaled_font(family, size, weight)
+
+    def setup_styles(self):
+        """Register how every widget's look depends on theme, scale and processing state"""
+        styles = self.styles
+        color, scaled, font = self.color, self.scaled, self.font
+
+        # Fonts, padding and spacing
+        styles.bind(self.title_label.config, {"scale"}, font=font("Segoe UI", 16, "bold"))
+        styles.bind(self.toggle_btn.config, {"scale"}, font=font("Segoe UI", 9),
+                    padx=scaled(15), pady=scaled(8))
+        styles.bind(self.scale_down_btn.config, {"scale"}, font=font("Segoe UI", 10, "bold"))
+        styles.bind(self.scale_up_btn.config, {"scale"}, font=font("Segoe UI", 10, "bold"))
+        styles.bind(self.scale_label.config, {"scale"}, font=font("Segoe UI", 9))
+        styles.bind(self.chat_box.config, {"scale"}, font=font("Segoe UI", 11),
+                    padx=scaled(20), pady=scaled(15),
+                    spacing1=scaled(5), spacing2=scaled(3), spacing3=scaled(10))
+        styles.bind(self.entry.config, {"scale"}, font=font("Segoe UI", 11),
+                    padx=scaled(15), pady=scaled(10))
+        styles.bind(self.send_btn.config, {"scale"}, font=font("Segoe UI", 10, "bold"),
+                    padx=scaled(20), pady=scaled(10))
+        styles.bind(self.clear_btn.config, {"scale"}, font=font("Segoe UI", 10, "bold"),
+                    padx=scaled(15), pady=scaled(8))
+        styles.bind(self.status_label.config, {"scale"}, font=font("Segoe UI", 9))
+        styles.bind(self.main_frame.pack_configure, {"scale"}, padx=scaled(20), pady=scaled(20))
 
-        # Reconfigure theme to update text tags
-        self.configure_theme()
+        # Update toggle button text
+        styles.bind(self.toggle_btn.config, {"theme"},
+                    text=lambda: "🌞 Light Mode" if self.is_dark else "🌙 Dark Mode")
+
+        # Main window and frames
+        for frame in (self.root, self.main_frame, self.title_frame, self.right_buttons_frame,
+                      self.input_frame, self.status_frame, self.scale_frame):
+            styles.bind(frame.configure, {"theme"}, bg=color("bg"))
+        styles.bind(self.input_container.configure, {"theme"},
+                    bg=color("input_bg"), highlightbackground=color("border"))
+        styles.bind(self.chat_container.configure, {"theme"},
+                    bg=color("border"), highlightbackground=color("border"))
+
+        # Labels
+        styles.bind(self.title_label.configure, {"theme"}, bg=color("bg"), fg=color("accent"))
+        for label in (self.status_label, self.message_counter, self.scale_label):
+            styles.bind(label.configure, {"theme"}, bg=color("bg"), fg=color("fg"))
+
+        # Chat box and input field
+        for text in (self.chat_box, self.entry):
+            styles.bind(text.configure, {"theme"},
+                        bg=color("input_bg" if text is self.entry else "bg"),
+                        fg=color("fg"),
+                        insertbackground=color("fg"),
+                        selectbackground=color("accent"),
+                        selectforeground=color("bg"))
+
+        # Send button - update based on processing state
+        styles.bind(self.send_btn.configure, {"theme", "processing"},
+                    bg=lambda: self.colors[self.is_dark][
+                        "accent_disabled" if self.is_processing else "accent"],
+                    fg=color("bg"),
+                    activebackground=lambda: self.colors[self.is_dark][
+                        "accent_disabled" if self.is_processing else "accent_hover"],
+                    activeforeground=color("bg"),
+                    state=lambda: tk.DISABLED if self.is_processing else tk.NORMAL)
+
+        # Other buttons
+        for button in (self.toggle_btn, self.clear_btn, self.scale_down_btn, self.scale_up_btn):
+            styles.bind(button.configure, {"theme"},
+                        bg=color("button"),
+                        fg=color("fg"),
+                        activebackground=color("button_hover"),
+                        activeforeground=color("fg"))
+
+        # Text tags for better message display
+        for tag, key, size, weight in (("user", "user_msg", 11, "bold"),
+                                       ("assistant", "assistant_msg", 11, "normal"),
+                                       ("error", "error_msg", 11, "normal")):
+            styles.bind(lambda tag=tag, **options: self.chat_box.tag_configure(tag, **options),
+                        {"theme", "scale"},
+                        foreground=color(key),
+                        font=font("Segoe UI", size, weight),
+                        lmargin1=scaled(20),
+                        lmargin2=scaled(40))
+        styles.bind(lambda **options: self.chat_box.tag_configure("timestamp", **options),
+                    {"theme", "scale"},
+                    foreground=color("fg"),
+                    font=font("Segoe UI", 9),
+                    lmargin1=scaled(20))
 
     def create_widgets(self):
         # Main container with increased padding for high-DPI
@@ -261,6 +379,9 @@ class ChatApp:
         self.chat_box.pack(fill=tk.BOTH, expand=True)
         self.chat_box.config(state=tk.DISABLED)
 
+        # Keeps only a window of the conversation in chat_box
+        self.transcript = ChatTranscript(self.chat_box)
+
         # Input section with improved layout
         self.input_frame = tk.Frame(self.main_frame)
         self.input_frame.pack(fill=tk.X)
@@ -328,130 +449,39 @@ class ChatApp:
         welcome_msg = "Hello! I'm your AI assistant. How can I help you today?"
         self.display_chat("Assistant", welcome_msg, role="assistant")
 
+    def restore_conversation(self):
+        """Show the conversation that was open when the app was last closed"""
+        self.conversation_history = load_conversation()
+        for message in self.conversation_history:
+            if message["role"] == "user":
+                self.display_chat("You", message["content"], role="user", show_timestamp=False)
+            else:
+                self.display_chat("Assistant", message["content"], role="assistant", show_timestamp=False)
+        self.update_message_counter()
+
     def configure_theme(self):
         """Apply theme colors with improved styling"""
-        theme = self.colors[self.is_dark]
-
-        # Update toggle button text
-        self.toggle_btn.config(text="🌞 Light Mode" if self.is_dark else "🌙 Dark Mode")
-
-        # Main window and frames
-        self.root.configure(bg=theme["bg"])
-        self.main_frame.configure(bg=theme["bg"])
-        self.title_frame.configure(bg=theme["bg"])
-        self.right_buttons_frame.configure(bg=theme["bg"])
-        self.input_frame.configure(bg=theme["bg"])
-        self.input_container.configure(bg=theme["input_bg"], highlightbackground=theme["border"])
-        self.chat_container.configure(bg=theme["border"], highlightbackground=theme["border"])
-        self.status_frame.configure(bg=theme["bg"])
-
-        # Labels
-        self.title_label.configure(bg=theme["bg"], fg=theme["accent"])
-        self.status_label.configure(bg=theme["bg"], fg=theme["fg"])
-        self.message_counter.configure(bg=theme["bg"], fg=theme["fg"])
-
-        # Chat box
-        self.chat_box.configure(
-            bg=theme["bg"],
-            fg=theme["fg"],
-            insertbackground=theme["fg"],
-            selectbackground=theme["accent"],
-            selectforeground=theme["bg"]
-        )
-
-        # Input field
-        self.entry.configure(
-            bg=theme["input_bg"],
-            fg=theme["fg"],
-            insertbackground=theme["fg"],
-            selectbackground=theme["accent"],
-            selectforeground=theme["bg"]
-        )
-
-        # Send button - update based on processing state
-        send_bg = theme["accent_disabled"] if self.is_processing else theme["accent"]
-        send_hover = theme["accent_disabled"] if self.is_processing else theme["accent_hover"]
-
-        self.send_btn.configure(
-            bg=send_bg,
-            fg=theme["bg"],
-            activebackground=send_hover,
-            activeforeground=theme["bg"],
-            state=tk.DISABLED if self.is_processing else tk.NORMAL
-        )
-
-        # Other buttons
-        self.toggle_btn.configure(
-            bg=theme["button"],
-            fg=theme["fg"],
-            activebackground=theme["button_hover"],
-            activeforeground=theme["fg"]
-        )
-
-        self.clear_btn.configure(
-            bg=theme["button"],
-            fg=theme["fg"],
-            activebackground=theme["button_hover"],
-            activeforeground=theme["fg"]
-        )
-
-        # Configure text tags for better message display
-        self.chat_box.tag_configure("user",
-                                    foreground=theme["user_msg"],
-                                    font=self.get_scaled_font("Segoe UI", 11, "bold"),
-                                    lmargin1=int(20 * self.scale_factor),
-                                    lmargin2=int(40 * self.scale_factor))
-
-        self.chat_box.tag_configure("assistant",
-                                    foreground=theme["assistant_msg"],
-                                    font=self.get_scaled_font("Segoe UI", 11),
-                                    lmargin1=int(20 * self.scale_factor),
-                                    lmargin2=int(40 * self.scale_factor))
-
-        self.chat_box.tag_configure("error",
-                                    foreground=theme["error_msg"],
-                                    font=self.get_scaled_font("Segoe UI", 11),
-                                    lmargin1=int(20 * self.scale_factor),
-                                    lmargin2=int(40 * self.scale_factor))
-
-        self.chat_box.tag_configure("timestamp",
-                                    foreground=theme["fg"],
-                                    font=self.get_scaled_font("Segoe UI", 9),
-                                    lmargin1=int(20 * self.scale_factor))
-
-        # Scale adjustment buttons
-        self.scale_frame.configure(bg=theme["bg"])
-        self.scale_down_btn.configure(
-            bg=theme["button"],
-            fg=theme["fg"],
-            activebackground=theme["button_hover"],
-            activeforeground=theme["fg"]
-        )
-        self.scale_up_btn.configure(
-            bg=theme["button"],
-            fg=theme["fg"],
-            activebackground=theme["button_hover"],
-            activeforeground=theme["fg"]
-        )
-        self.scale_label.configure(bg=theme["bg"], fg=theme["fg"])
-
-        # Update scale label
-        self.scale_label.config(text=f"{self.scale_factor:.1f}x")
+        self.styles.apply("theme", "processing")
 
     def toggle_theme(self):
         """Toggle between light and dark themes"""
         self.is_dark = not self.is_dark
-        self.configure_theme()
+        self.styles.apply("theme")
 
     def clear_conversation(self):
         """Clear the conversation history"""
         result = messagebox.askyesno("Clear Conversation",
                                      "Are you sure you want to clear the conversation history?")
         if result:
-            self.chat_box.config(state=tk.NORMAL)
-            self.chat_box.delete(1.0, tk.END)
-            self.chat_box.config(state=tk.DISABLED)
+            self.cancel_response()
+            # The answer still streaming belonged to the old conversation;
+            # flush_stream drains the rest of it without showing or keeping it
+            self.stream_discarded = True
+            self.stream_text = []
+            self.pending_inputs.clear()
+            self.transcript.clear()
             self.conversation_history.clear()
+            save_conversation(self.conversation_history)
             self.update_message_counter()
             self.display_welcome()
 
@@ -471,46 +501,183 @@ class ChatApp:
 
         self.entry.delete("1.0", tk.END)
         self.display_chat("You", user_input, role="user")
-        self.conversation_history.append({"role": "user", "content": user_input})
+        message = {"role": "user", "content": user_input}
+        self.conversation_history.append(message)
         self.update_message_counter()
 
-        # Show thinking indicator
+        if not self.model_ready:
+            self.pending_inputs.append(message)
+            if not self.model_loading:
+                self.start_model_loading()
+            self.status_label.config(text=f"Loading model... ({len(self.pending_inputs)} queued)")
+            return "break"
 
-        # Process response in a separate thread to avoid blocking UI
-        threading.Thread(target=self.process_response, args=(user_input,), daemon=True).start()
+        self.start_response(message)
 
         return "break"
 
+    def start_next_pending(self):
+        """Answer the next queued message, if any"""
+        if self.pending_inputs:
+            self.start_response(self.pending_inputs.pop(0))
+        else:
+            self.status_label.config(text=self.ready_status())
+
+    def ready_status(self):
+        """Status bar text with the stats of the last answer"""
+        record = metrics_log.last()
+        if record is None:
+            return "Ready"
+        if record["cached"]:
+            return "Ready · last answer from cache"
+        parts = [f"{record['completion_tokens']} tokens"]
+        if record["ttft"] is not None:
+            parts.append(f"first token {record['ttft']:.2f}s")
+        if record["decode_tokens_per_s"] is not None:
+            parts.append(f"{record['decode_tokens_per_s']:.1f} tok/s")
+        parts.append(f"{record['total']:.1f}s total")
+        return "Ready · " + " · ".join(parts)
+
+    def toggle_profiling(self, event=None):
+        """Cycle profiling of answers for debugging slow turns"""
+        mode = metrics_log.cycle_profiling()
+        self.status_label.config(text=f"Profiling: {mode or 'off'} (see {metrics_log.path})")
+
+    def start_response(self, message):
+        """Start generating the answer to a user message from conversation_history"""
+        # Everything said before this message is context for the answer
+        position = next(i for i, m in enumerate(self.conversation_history) if m is message)
+        history = self.conversation_history[:position]
+        self.answering = message
+
+        # Show thinking indicator
+        self.is_processing = True
+        self.styles.apply("processing")  # Update button state
+        self.status_label.config(text="Generating... (Esc to stop)")
+
+        # Process response in a separate thread to avoid blocking UI
+        self.cancel_event = threading.Event()
+        self.stream_text = []
+        self.stream_discarded = False
+        self.stream_pieces = 0
+        self.stream_started = time.perf_counter()
+        threading.Thread(target=self.process_response,
+                         args=(message["content"], history, self.cancel_event),
+                         daemon=True).start()
+        self.root.after(self.stream_flush_ms, self.flush_stream)
+
     def insert_newline(self, event=None):
         """Insert newline on Shift+Enter"""
         return None  # Allow default behavior
 
 
-    def process_response(self, user_input):
-        """Process AI response in a separate thread"""
+    def process_response(self, user_input, history, cancel_event):
+        """Stream AI response into stream_queue from a separate thread"""
         try:
-            response = get_answer(user_input)
-            # Update UI in main thread
-            self.root.after(0, self.display_response, response)
+            for chunk in stream_answer(user_input, cancel_event, block=False, history=history):
+                self.stream_queue.put(chunk)
+            self.stream_queue.put(None)  # End of stream
         except Exception as e:
-            error_msg = f"Sorry, I encountered an error: {str(e)}"
-            self.root.after(0, self.display_response, error_msg, True)
+            self.stream_queue.put(e)
+
+    def flush_stream(self):
+        """Append queued tokens to the chat box in one batch (called from main thread)"""
+        chunks = []
+        end = False
+        error = None
+        while True:
+            try:
+                item = self.stream_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None or isinstance(item, Exception):
+                end, error = True, item
+                break
+            chunks.append(item)
+
+        if chunks:
+            self.append_stream_text("".join(chunks))
+            self.stream_pieces += len(chunks)
+            if not self.cancel_event.is_set():
+                elapsed = time.perf_counter() - self.stream_started
+                # Pieces of text, not tokens: text held back for stop strings
+                # arrives merged. The token count is shown once the answer ends.
+                self.status_label.config(
+                    text=f"Generating... {self.stream_pieces} chunks, "
+                         f"{self.stream_pieces / elapsed:.1f} chunks/s (Esc to stop)")
+
+        if end:
+            self.finish_stream(error)
+        else:
+            self.root.after(self.stream_flush_ms, self.flush_stream)
+
+    def append_stream_text(self, text):
+        """Insert streamed text at the end of the chat box"""
+        if self.stream_discarded:
+            return
+        if not self.stream_text:
+            text = text.lstrip()
+            if not text:
+                return
+        if not self.stream_text:
+            self.transcript.begin_stream("assistant")
+        self.stream_text.append(text)
+        self.transcript.append_stream(text)
+
+    def finish_stream(self, error=None):
+        """Close the streamed message and reset processing state"""
+        response = "".join(self.stream_text).strip()
+        self.transcript.end_stream()
+        # A stopped answer stays on screen but is left out of the history the
+        # next questions are answered with
+        if response and not self.cancel_event.is_set():
+            self.add_answer(response)
+        self.stream_text = []
+
+        if error is not None and not self.stream_discarded:
+            error_msg = f"Sorry, I encountered an error: {str(error)}"
+            self.display_response(error_msg, True)
+        else:
+            self.display_response(None)
+
+    def cancel_response(self, event=None):
+        """Stop the answer currently being generated"""
+        if self.is_processing:
+            self.cancel_event.set()
+            self.status_label.config(text="Stopping...")
 
     def display_response(self, response, is_error=False):
-        """Display AI response (called from main thread)"""
+        """Display AI response (called from main thread)
 
-        role = "error" if is_error else "assistant"
-        self.display_chat("Assistant", response, role=role, show_timestamp=False)
+        response is None when the answer was already streamed into the chat box.
+        """
 
-        if not is_error:
-            self.conversation_history.append({"role": "assistant", "content": response})
-            self.update_message_counter()
+        if response is not None:
+            role = "error" if is_error else "assistant"
+            self.display_chat("Assistant", response, role=role, show_timestamp=False)
+
+        if response is not None and not is_error:
+            self.add_answer(response)
+        save_conversation(self.conversation_history)
 
         self.is_processing = False
-        self.configure_theme()  # Update button state
-        self.status_label.config(text="Ready")
+        self.styles.apply("processing")  # Update button state
         self.entry.focus_set()  # Return focus to input
 
+        if self.model_ready:
+            self.start_next_pending()
+
+    def add_answer(self, response):
+        """Add response to conversation_history right after the question it answers
+
+        Messages typed while the model loaded are already in the history, so
+        the answer to an earlier one must not simply be appended after them.
+        """
+        position = next((i for i, m in enumerate(self.conversation_history) if m is self.answering),
+                        len(self.conversation_history) - 1)
+        self.conversation_history.insert(position + 1, {"role": "assistant", "content": response})
+        self.update_message_counter()
+
     def update_message_counter(self):
         """Update message counter display"""
         count = len([msg for msg in self.conversation_history if msg["role"] == "user"])
@@ -518,22 +685,7 @@ class ChatApp:
 
     def display_chat(self, speaker, message, role="assistant", show_timestamp=True):
         """Display chat message with improved formatting"""
-        self.chat_box.config(state=tk.NORMAL)
-
-        if show_timestamp:
-            # Add timestamp and speaker
-            import datetime
-            timestamp = datetime.datetime.now().strftime("%H:%M")
-            self.chat_box.insert(tk.END, f"[{timestamp}] {speaker}:\n", "timestamp")
-
-        # Insert message
-        self.chat_box.insert(tk.END, f"{message.strip()}\n\n", role)
-
-        self.chat_box.config(state=tk.DISABLED)
-        self.chat_box.see(tk.END)
-
-        # Auto-scroll to bottom
-        self.root.after(1, lambda: self.chat_box.see(tk.END))
+        self.transcript.add(speaker, message.strip(), role, show_timestamp)
 
     def on_window_resize(self, event=None):
         """Handle window resize events"""
@@ -548,6 +700,7 @@ class ChatApp:
                                          "AI is still processing. Are you sure you want to exit?")
             if not result:
                 return
+            self.cancel_event.set()
         self.root.destroy()
 
 
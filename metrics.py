@@ -0,0 +1,210 @@
+import cProfile
+import glob
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+PROFILE_MODES = (None, "cprofile", "tracemalloc")
+# cProfile dumps kept next to the log; older ones are deleted
+MAX_PROFILE_DUMPS = 20
+
+
+class RequestMetrics:
+    """Timings and token counts of one request, filled in as it moves along"""
+
+    def __init__(self, question: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.question_chars = len(question)
+        self.cached = False
+        # Cached answer of a differently worded question with the same meaning
+        self.semantic = False
+        self.cancelled = False
+        self.error = None
+        self.submitted = time.perf_counter()
+        self.started = None
+        # Embedding the question for the semantic cache, including loading
+        # the embedding model on first use
+        self.embed_started = None
+        self.embedded = None
+        self.build_started = None
+        # Seconds of prompt building spent evaluating (or restoring) the
+        # cached company info prefix
+        self.prefix_prefill = None
+        self.prompt_built = None
+        self.tokenized = None
+        self.first_token = None
+        self.finished = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Tokens proposed by the draft model and kept by the main model
+        # (speculative decoding only)
+        self.draft_proposed = 0
+        self.draft_accepted = 0
+        # Rule of stopping.py that ended the answer before max_tokens, and
+        # how many tokens of the budget that left unused
+        self.stop_reason = None
+        self.tokens_saved = 0
+        self.profile = None
+
+    def record(self) -> dict:
+        """Flatten into one metrics log line (seconds, rounded to 0.1ms)"""
+        def span(start, end):
+            if start is None or end is None:
+                return None
+            return round(end - start, 4)
+
+        finished = self.finished or time.perf_counter()
+        decode_seconds = span(self.first_token, finished)
+        record = {
+            "id": self.id,
+            "time": round(time.time(), 3),
+            "cached": self.cached,
+            "semantic": self.semantic,
+            "cancelled": self.cancelled,
+            "error": self.error,
+            "question_chars": self.question_chars,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "queue_wait": span(self.submitted, self.started),
+            "embedding": span(self.embed_started, self.embedded),
+            "prompt_build": (
+                round(span(self.build_started, self.prompt_built) - (self.prefix_prefill or 0), 4)
+                if self.build_started is not None and self.prompt_built is not None else None
+            ),
+            "prefix_prefill": round(self.prefix_prefill, 4) if self.prefix_prefill is not None else None,
+            "tokenize": span(self.prompt_built, self.tokenized),
+            # Time to first token includes prefill plus the first decode step
+            "prefill": span(self.tokenized, self.first_token),
+            "ttft": span(self.submitted, self.first_token),
+            "decode_tokens_per_s": (
+                round((self.completion_tokens - 1) / decode_seconds, 2)
+                if decode_seconds and self.completion_tokens > 1 else None
+            ),
+            "total": span(self.submitted, finished),
+            "draft_acceptance": (
+                round(self.draft_accepted / self.draft_proposed, 3) if self.draft_proposed else None
+            ),
+            "stop_reason": self.stop_reason,
+            "tokens_saved": self.tokens_saved,
+        }
+        if self.profile is not None:
+            record["profile"] = self.profile
+        return record
+
+
+class MetricsLog:
+    """Writes request metrics to a rotating JSONL file and keeps recent ones in memory.
+
+    Setting profiling to "cprofile" or "tracemalloc" (or the AI_AGENT_PROFILE
+    environment variable) captures a profile of every generation while it is on.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 5 * 1024 * 1024, backups: int = 3, keep: int = 100):
+        self.path = path
+        self.recent = deque(maxlen=keep)
+        self.profiling = os.environ.get("AI_AGENT_PROFILE") or None
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(f"{__name__}.{path}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def finish(self, request: RequestMetrics) -> dict:
+        if request.finished is None:
+            request.finished = time.perf_counter()
+        record = request.record()
+        with self._lock:
+            self.recent.append(record)
+        self._logger.info(json.dumps(record))
+        return record
+
+    def last(self):
+        with self._lock:
+            return self.recent[-1] if self.recent else None
+
+    def summary(self) -> dict:
+        """Averages over the recent requests that were actually generated"""
+        with self._lock:
+            generated = [r for r in self.recent if not r["cached"] and r["ttft"] is not None]
+            cached = sum(1 for r in self.recent if r["cached"])
+            semantic = sum(1 for r in self.recent if r.get("semantic"))
+            total = len(self.recent)
+
+        def mean(key):
+            values = [r[key] for r in generated if r[key] is not None]
+            return round(sum(values) / len(values), 4) if values else None
+
+        return {
+            "requests": total,
+            "cached": cached,
+            "semantic": semantic,
+            "ttft": mean("ttft"),
+            "queue_wait": mean("queue_wait"),
+            "embedding": mean("embedding"),
+            "prefix_prefill": mean("prefix_prefill"),
+            "decode_tokens_per_s": mean("decode_tokens_per_s"),
+            "draft_acceptance": mean("draft_acceptance"),
+            "tokens_saved": sum(r.get("tokens_saved", 0) for r in generated),
+            "total": mean("total"),
+        }
+
+    def cycle_profiling(self):
+        """Switch to the next profiling mode and return it"""
+        index = PROFILE_MODES.index(self.profiling) if self.profiling in PROFILE_MODES else 0
+        self.profiling = PROFILE_MODES[(index + 1) % len(PROFILE_MODES)]
+        return self.profiling
+
+    def _prune_profiles(self):
+        """Delete all but the newest MAX_PROFILE_DUMPS profile dumps"""
+        pattern = f"{glob.escape(os.path.splitext(self.path)[0])}-*.prof"
+        try:
+            for path in sorted(glob.glob(pattern), key=os.path.getmtime)[:-MAX_PROFILE_DUMPS]:
+                os.remove(path)
+        except OSError:
+            # Another process pruned them first
+            pass
+
+    @contextmanager
+    def profile(self, request: RequestMetrics):
+        """Capture a profile of the enclosed work into request.profile when profiling is on"""
+        mode = self.profiling
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profile_path = f"{os.path.splitext(self.path)[0]}-{request.id}.prof"
+                profiler.dump_stats(profile_path)
+                self._prune_profiles()
+                text = io.StringIO()
+                pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(15)
+                request.profile = {"mode": mode, "path": profile_path, "top": text.getvalue()}
+        elif mode == "tracemalloc":
+            started_here = not tracemalloc.is_tracing()
+            if started_here:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+                if started_here:
+                    tracemalloc.stop()
+                request.profile = {"mode": mode, "peak_bytes": peak, "top": [str(stat) for stat in top]}
+        else:
+            yield
@@ -0,0 +1,290 @@
+"""Named model profiles read from a TOML file.
+
+A profile holds the Llama settings for one model on one machine:
+
+    default_profile = "laptop"
+
+    [profiles.laptop]
+    model_path = "models/assistant-q4_k_m.gguf"
+    n_ctx = 2048
+    n_threads = 6          # decode threads
+    n_threads_batch = 8    # prompt evaluation threads
+    n_batch = 512
+    use_mmap = true
+    use_mlock = false
+    type_k = "q8_0"        # KV cache type (f32, f16, q8_0, q5_1, q5_0, q4_1, q4_0)
+    draft_model_path = "models/assistant-tiny-q8_0.gguf"   # speculative decoding
+    draft_tokens = 8
+
+The file is ai_agent.toml next to this module unless AI_AGENT_CONFIG points
+elsewhere, and AI_AGENT_MODEL_PROFILE selects a profile other than the
+default. Any other key of the profile is passed to Llama() as is.
+
+Run this module to write a profile tuned for the current machine:
+
+    python model_config.py tune --model models/assistant-q4_k_m.gguf --profile laptop
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tomllib
+
+CONFIG_PATH = os.environ.get(
+    "AI_AGENT_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ai_agent.toml")
+)
+
+# ggml type ids accepted by Llama(type_k=..., type_v=...)
+KV_CACHE_TYPES = {"f32": 0, "f16": 1, "q4_0": 2, "q4_1": 3, "q5_0": 6, "q5_1": 7, "q8_0": 8}
+
+TUNE_BATCH_SIZES = (128, 256, 512, 1024)
+TUNE_DECODE_TOKENS = 32
+TUNE_TEXT = (
+    "Our support team answers questions about orders, shipping, refunds and "
+    "accounts from Monday to Friday between nine and five. "
+)
+
+
+class ConfigError(ValueError):
+    """Raised for a missing profile or an invalid setting in the config file"""
+
+
+def read_config(path: str = CONFIG_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        try:
+            return tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ConfigError(f"{path}: {e}")
+
+
+def load_profile(name: str = None, path: str = CONFIG_PATH) -> dict:
+    """Return the settings of profile name (or the selected/default one).
+
+    An empty dict is returned when there is no config file, so the built-in
+    defaults apply. KV cache type names are converted to ggml type ids.
+    """
+    config = read_config(path)
+    name = name or os.environ.get("AI_AGENT_MODEL_PROFILE") or config.get("default_profile")
+    profiles = config.get("profiles", {})
+    if not name:
+        return {}
+    if name not in profiles:
+        raise ConfigError(f"No profile named {name!r} in {path}")
+
+    profile = dict(profiles[name])
+    for key in ("type_k", "type_v"):
+        value = profile.get(key)
+        if isinstance(value, str):
+            if value.lower() not in KV_CACHE_TYPES:
+                raise ConfigError(f"Unknown {key} {value!r} in profile {name!r}, expected one of "
+                                  f"{', '.join(KV_CACHE_TYPES)}")
+            profile[key] = KV_CACHE_TYPES[value.lower()]
+    return profile
+
+
+def _toml_value(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        # JSON string escapes are valid in TOML basic strings
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, list):
+        return "[" + ", ".join(_toml_value(v) for v in value) + "]"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k} = {_toml_value(v)}" for k, v in value.items()) + "}"
+    raise TypeError(f"Can't write {type(value).__name__} to TOML")
+
+
+def write_profile(name: str, settings: dict, path: str = CONFIG_PATH, make_default: bool = False):
+    """Add or replace profile name in the config file, keeping the other profiles.
+
+    The file is rewritten from its parsed content, so comments are not kept.
+    """
+    config = read_config(path)
+    config.setdefault("profiles", {})[name] = settings
+    if make_default or "default_profile" not in config:
+        config["default_profile"] = name
+
+    lines = [f"default_profile = {_toml_value(config['default_profile'])}"]
+    for profile_name, profile in config["profiles"].items():
+        lines.append(f"\n[profiles.{profile_name}]")
+        tables = {}  # Arrays of tables, e.g. intents, follow the plain keys
+        for key, value in profile.items():
+            if isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+                tables[key] = value
+            else:
+                lines.append(f"{key} = {_toml_value(value)}")
+        for key, entries in tables.items():
+            for entry in entries:
+                lines.append(f"\n[[profiles.{profile_name}.{key}]]")
+                lines += [f"{k} = {_toml_value(v)}" for k, v in entry.items()]
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_path, path)
+
+
+def physical_cores() -> int:
+    """Number of physical cores, falling back to the logical CPU count"""
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return cores
+    except ImportError:
+        pass
+    try:
+        cores = set()
+        physical_id = None
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    cores.add((physical_id, value.strip()))
+        if cores:
+            return len(cores)
+    except OSError:
+        pass
+    return os.cpu_count() or 1
+
+
+def total_memory():
+    """Physical memory in bytes, or None where it can't be read"""
+    try:
+        import psutil
+        return psutil.virtual_memory().total
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _measure(settings: dict) -> tuple:
+    """Load a model with settings and return (prefill tok/s, decode tok/s)"""
+    import ai_agent
+
+    ai_agent.unload_model()
+    ai_agent.PLAN_MEMORY = False
+    ai_agent.session_store = None
+    ai_agent.MODEL_PATH = settings["model_path"]
+    ai_agent.N_CTX = settings["n_ctx"]
+    ai_agent.N_THREADS = settings["n_threads"]
+    ai_agent.MODEL_OPTIONS = {k: v for k, v in settings.items() if k not in ("model_path", "n_ctx", "n_threads")}
+    model = ai_agent.load_model()
+
+    text = TUNE_TEXT
+    tokens = model.tokenize(text.encode("utf-8"), add_bos=True)
+    # Enough prompt tokens to fill the largest batch twice
+    while len(tokens) < min(2 * max(TUNE_BATCH_SIZES), settings["n_ctx"] // 2):
+        text += TUNE_TEXT
+        tokens = model.tokenize(text.encode("utf-8"), add_bos=True)
+    tokens = tokens[:settings["n_ctx"] // 2]
+
+    model.reset()
+    start = time.perf_counter()
+    model.eval(tokens)
+    prefill = len(tokens) / (time.perf_counter() - start)
+
+    model.reset()
+    first = None
+    generated = 0
+    for _ in model(tokens[:64], max_tokens=TUNE_DECODE_TOKENS, temperature=0.0, stream=True):
+        if first is None:
+            first = time.perf_counter()
+        generated += 1
+    decode = (generated - 1) / (time.perf_counter() - first) if generated > 1 else 0.0
+    return prefill, decode
+
+
+def tune(model_path: str, n_ctx: int = 2048, backend: str = None) -> dict:
+    """Probe this machine and return the profile settings with the best throughput.
+
+    Decode speed usually peaks at or below the number of physical cores, while
+    prompt evaluation keeps scaling a little further, so the two thread counts
+    are tuned separately, then the batch size for the best prefill count.
+    """
+    import ai_agent
+
+    if backend:
+        ai_agent.MODEL_BACKEND = backend
+    cores = physical_cores()
+    logical = os.cpu_count() or cores
+    memory = total_memory()
+    model_bytes = os.path.getsize(model_path) if os.path.exists(model_path) else 0
+    print(f"{cores} physical cores, {logical} logical CPUs, "
+          f"{memory / 2 ** 30:.1f} GB memory" if memory else f"{cores} physical cores, {logical} logical CPUs")
+
+    settings = {"model_path": model_path, "n_ctx": n_ctx, "use_mmap": True, "use_mlock": False}
+    # Keep the weights resident when they fit comfortably, so the OS never
+    # pages them out between questions
+    if memory and model_bytes and model_bytes < memory * 0.5:
+        settings["use_mlock"] = True
+    # Halve the KV cache when the model barely fits
+    if memory and model_bytes and model_bytes > memory * 0.6:
+        settings["type_k"] = KV_CACHE_TYPES["q8_0"]
+
+    thread_counts = sorted({max(1, cores // 2), max(1, cores - 1), cores, logical})
+    results = {}
+    for threads in thread_counts:
+        results[threads] = _measure({**settings, "n_threads": threads, "n_threads_batch": threads,
+                                     "n_batch": 512})
+        print(f"  {threads:>3} threads: prefill {results[threads][0]:.1f} tok/s, "
+              f"decode {results[threads][1]:.1f} tok/s")
+    settings["n_threads"] = max(results, key=lambda t: results[t][1])
+    settings["n_threads_batch"] = max(results, key=lambda t: results[t][0])
+
+    batches = {}
+    for n_batch in TUNE_BATCH_SIZES:
+        if n_batch > n_ctx:
+            continue
+        batches[n_batch] = _measure({**settings, "n_batch": n_batch})[0]
+        print(f"  n_batch {n_batch:>4}: prefill {batches[n_batch]:.1f} tok/s")
+    settings["n_batch"] = max(batches, key=batches.get)
+    ai_agent.unload_model()
+
+    if backend:
+        settings["backend"] = backend
+    if "type_k" in settings:
+        names = {v: k for k, v in KV_CACHE_TYPES.items()}
+        settings["type_k"] = names[settings["type_k"]]
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage model profiles in ai_agent.toml")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print the settings of a profile")
+    show.add_argument("profile", nargs="?")
+    tune_parser = commands.add_parser("tune", help="benchmark this machine and write a tuned profile")
+    tune_parser.add_argument("--model", required=True, help="model file to tune for")
+    tune_parser.add_argument("--profile", default="default", help="name of the profile to write")
+    tune_parser.add_argument("--n-ctx", type=int, default=2048)
+    tune_parser.add_argument("--stub", action="store_true", help="tune against the simulated model")
+    tune_parser.add_argument("--make-default", action="store_true", help="make it the default profile")
+    parser.add_argument("--config", default=CONFIG_PATH, help="config file (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "show":
+            for key, value in load_profile(args.profile, args.config).items():
+                print(f"{key} = {value!r}")
+            return
+        settings = tune(args.model, args.n_ctx, "stub" if args.stub else None)
+        write_profile(args.profile, settings, args.config, args.make_default)
+    except ConfigError as e:
+        sys.exit(str(e))
+    print(f"Wrote profile {args.profile!r} to {args.config}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Fit the model to the machine's memory before the weights are loaded.
+
+A model that doesn't fit in RAM doesn't fail to load, it pages itself in
+and out on every token. The planner reads the GGUF header (metadata and
+tensor list, not the weights), estimates the resident memory of the weights
+plus the KV cache for the configured n_ctx, and before anything is loaded:
+
+- picks the largest quantization variant in model_dir that fits the budget,
+- or lowers n_ctx until the model fits,
+- or refuses with InsufficientMemoryError.
+
+Run it to see the numbers for a model file or directory:
+
+    python model_planner.py models/llama-Q8_0.gguf --model-dir models --n-ctx 4096 --budget-mb 6000
+"""
+import argparse
+import glob
+import os
+import re
+import struct
+import sys
+
+GGUF_MAGIC = b"GGUF"
+# GGUF metadata value types with a fixed size
+_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+_STRING = 8
+_ARRAY = 9
+
+# Bytes per element of the KV cache types (ggml type ids, as in
+# model_config.KV_CACHE_TYPES); quantized types pack 32 values per block
+KV_TYPE_BYTES = {0: 4.0, 1: 2.0, 2: 18 / 32, 3: 20 / 32, 6: 22 / 32, 7: 24 / 32, 8: 34 / 32}
+F16 = 1
+
+# Scratch buffers for evaluation besides the logits, and what the process
+# itself takes
+BASE_OVERHEAD = 256 * 1024 * 1024
+# Share of the memory available at startup the model may use by default
+MEMORY_FRACTION = 0.85
+MIN_N_CTX = 512
+
+_SPLIT = re.compile(r"-(\d{5})-of-(\d{5})\.gguf$")
+
+
+class GGUFError(ValueError):
+    """Raised for a file that isn't a readable GGUF model"""
+
+
+class InsufficientMemoryError(RuntimeError):
+    """Raised when no model variant fits the memory budget even at MIN_N_CTX"""
+
+
+class GGUFInfo:
+    """Metadata and tensor sizes of a GGUF file, read without the weights.
+
+    Array values (the tokenizer vocabulary and the like) are kept as their
+    length only.
+    """
+
+    def __init__(self, path: str, version: int, metadata: dict, n_params: int, data_offset: int):
+        self.path = path
+        self.version = version
+        self.metadata = metadata
+        self.n_params = n_params
+        self.data_offset = data_offset
+        self.weights_bytes = sum(os.path.getsize(p) for p in split_files(path, metadata)) - data_offset
+
+    def _arch(self, key: str, default=None):
+        value = self.metadata.get(f"{self.architecture}.{key}", default)
+        return max(value) if isinstance(value, list) else value
+
+    @property
+    def architecture(self) -> str:
+        return self.metadata.get("general.architecture", "")
+
+    @property
+    def name(self) -> str:
+        return self.metadata.get("general.name") or os.path.basename(self.path)
+
+    @property
+    def n_layer(self) -> int:
+        return self._arch("block_count", 0)
+
+    @property
+    def n_embd(self) -> int:
+        return self._arch("embedding_length", 0)
+
+    @property
+    def n_head(self) -> int:
+        return self._arch("attention.head_count", 0) or 1
+
+    @property
+    def n_head_kv(self) -> int:
+        return self._arch("attention.head_count_kv", None) or self.n_head
+
+    @property
+    def context_length(self):
+        """Context the model was trained for, or None when unknown"""
+        return self._arch("context_length")
+
+    @property
+    def n_vocab(self) -> int:
+        return self._arch("vocab_size") or self.metadata.get("tokenizer.ggml.tokens", 0)
+
+    @property
+    def bits_per_weight(self) -> float:
+        return self.weights_bytes * 8 / self.n_params if self.n_params else 0.0
+
+    def kv_cache_bytes(self, n_ctx: int, type_k: int = F16, type_v: int = F16) -> int:
+        head_dim = self.n_embd // self.n_head
+        key_length = self._arch("attention.key_length", head_dim)
+        value_length = self._arch("attention.value_length", head_dim)
+        per_token = self.n_layer * self.n_head_kv * (
+            key_length * KV_TYPE_BYTES.get(type_k, 2.0) + value_length * KV_TYPE_BYTES.get(type_v, 2.0))
+        return int(n_ctx * per_token)
+
+    def memory_bytes(self, n_ctx: int, type_k: int = F16, type_v: int = F16, n_batch: int = 512) -> int:
+        """Estimated resident memory with one context of n_ctx tokens"""
+        logits = n_batch * self.n_vocab * 4
+        return self.weights_bytes + self.kv_cache_bytes(n_ctx, type_k, type_v) + logits + BASE_OVERHEAD
+
+
+def split_files(path: str, metadata: dict) -> list:
+    """All files of a model split into several GGUF files (path alone for one file)"""
+    match = _SPLIT.search(path)
+    if not match or metadata.get("split.count", 1) <= 1:
+        return [path]
+    return sorted(glob.glob(path[:match.start()] + f"-*-of-{match.group(2)}.gguf"))
+
+
+def _read(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise GGUFError(f"{f.name}: unexpected end of file")
+    return data
+
+
+def _string(f) -> str:
+    (length,) = struct.unpack("<Q", _read(f, 8))
+    return _read(f, length).decode("utf-8", errors="replace")
+
+
+def _value(f, value_type: int):
+    if value_type in _SCALARS:
+        fmt = _SCALARS[value_type]
+        return struct.unpack(fmt, _read(f, struct.calcsize(fmt)))[0]
+    if value_type == _STRING:
+        return _string(f)
+    if value_type == _ARRAY:
+        item_type, count = struct.unpack("<IQ", _read(f, 12))
+        if item_type in _SCALARS and count <= 1024:
+            # Small numeric arrays (e.g. per-layer head counts) are kept
+            fmt = "<" + _SCALARS[item_type][1] * count
+            return list(struct.unpack(fmt, _read(f, struct.calcsize(fmt))))
+        if item_type in _SCALARS:
+            f.seek(count * struct.calcsize(_SCALARS[item_type]), os.SEEK_CUR)
+        else:
+            for _ in range(count):
+                _value(f, item_type)
+        return count
+    raise GGUFError(f"{f.name}: unknown metadata value type {value_type}")
+
+
+def read_gguf(path: str) -> GGUFInfo:
+    """Read the header of the GGUF file at path"""
+    with open(path, "rb") as f:
+        if _read(f, 4) != GGUF_MAGIC:
+            raise GGUFError(f"{path} is not a GGUF file")
+        version, n_tensors, n_metadata = struct.unpack("<IQQ", _read(f, 20))
+        if version < 2:
+            raise GGUFError(f"{path}: GGUF version {version} is not supported")
+        metadata = {}
+        for _ in range(n_metadata):
+            key = _string(f)
+            (value_type,) = struct.unpack("<I", _read(f, 4))
+            metadata[key] = _value(f, value_type)
+
+        n_params = 0
+        for _ in range(n_tensors):
+            _string(f)
+            (n_dims,) = struct.unpack("<I", _read(f, 4))
+            elements = 1
+            for dim in struct.unpack(f"<{n_dims}Q", _read(f, 8 * n_dims)):
+                elements *= dim
+            _read(f, 12)  # type and offset
+            n_params += elements
+
+        alignment = metadata.get("general.alignment", 32)
+        data_offset = -(-f.tell() // alignment) * alignment
+    return GGUFInfo(path, version, metadata, n_params, data_offset)
+
+
+def available_memory():
+    """Memory that can be used without swapping, in bytes, or None where it can't be read"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    from model_config import total_memory
+
+    return total_memory()
+
+
+def default_budget():
+    memory = available_memory()
+    return int(memory * MEMORY_FRACTION) if memory else None
+
+
+class Plan:
+    """The model file and n_ctx chosen, with the estimate that chose them"""
+
+    def __init__(self, info: GGUFInfo, n_ctx: int, memory_bytes: int, budget: int, notes: list):
+        self.info = info
+        self.model_path = info.path
+        self.n_ctx = n_ctx
+        self.memory_bytes = memory_bytes
+        self.budget = budget
+        self.notes = notes
+
+
+def candidates(model_path: str, model_dir: str = None) -> list:
+    """GGUFInfo of model_path, or of the variants of the same model in model_dir, largest first"""
+    if not model_dir:
+        return [read_gguf(model_path)]
+    paths = [p for p in sorted(glob.glob(os.path.join(model_dir, "*.gguf")))
+             if not _SPLIT.search(p) or _SPLIT.search(p).group(1) == "00001"]
+    infos = []
+    for path in paths:
+        try:
+            infos.append(read_gguf(path))
+        except (OSError, GGUFError):
+            continue
+    if os.path.exists(model_path):
+        # Only quantizations of the configured model, not whatever else is there
+        wanted = read_gguf(model_path)
+        infos = [i for i in infos if i.architecture == wanted.architecture and i.n_params == wanted.n_params] \
+            or [wanted]
+    if not infos:
+        raise GGUFError(f"No GGUF models in {model_dir}")
+    return sorted(infos, key=lambda i: i.weights_bytes, reverse=True)
+
+
+def plan(model_path: str, n_ctx: int, budget: int = None, type_k: int = F16, type_v: int = F16,
+         model_dir: str = None, n_contexts: int = 1, extra_bytes: int = 0, n_batch: int = 512) -> Plan:
+    """Choose the model file and n_ctx to load within budget bytes.
+
+    The largest variant that fits with the full n_ctx wins. When none does,
+    n_ctx is halved (down to MIN_N_CTX) for the smallest variant. n_contexts
+    is how many KV caches of n_ctx tokens are allocated, and extra_bytes is
+    memory used by anything else loaded with the model (a draft model).
+    """
+    infos = candidates(model_path, model_dir)
+    budget = budget or default_budget()
+
+    def memory(info, n):
+        kv = info.kv_cache_bytes(n, type_k, type_v) * (n_contexts - 1)
+        return info.memory_bytes(n, type_k, type_v, n_batch) + kv + extra_bytes
+
+    notes = []
+    if budget is None:
+        return Plan(infos[0], n_ctx, memory(infos[0], n_ctx), None, notes + ["memory size unknown, not checked"])
+
+    for info in infos:
+        if memory(info, n_ctx) <= budget:
+            if info is not infos[0]:
+                notes.append(f"{os.path.basename(info.path)} chosen, larger variants don't fit")
+            return Plan(info, n_ctx, memory(info, n_ctx), budget, notes)
+
+    smallest = infos[-1]
+    n = n_ctx
+    while n > MIN_N_CTX:
+        n = max(MIN_N_CTX, n // 2)
+        if memory(smallest, n) <= budget:
+            if smallest is not infos[0]:
+                notes.append(f"{os.path.basename(smallest.path)} chosen, larger variants don't fit")
+            notes.append(f"n_ctx lowered from {n_ctx} to {n} to fit in memory")
+            return Plan(smallest, n, memory(smallest, n), budget, notes)
+    raise InsufficientMemoryError(
+        f"{os.path.basename(smallest.path)} needs about {memory(smallest, MIN_N_CTX) / 2 ** 20:.0f} MB "
+        f"with n_ctx {MIN_N_CTX}, but only {budget / 2 ** 20:.0f} MB is available; "
+        f"use a smaller quantization or set memory_budget_mb"
+    )
+
+
+def main(argv=None):
+    from model_config import KV_CACHE_TYPES
+
+    parser = argparse.ArgumentParser(description="Estimate the memory a GGUF model needs and plan how to load it")
+    parser.add_argument("model", help="GGUF model file")
+    parser.add_argument("--model-dir", help="directory with other quantizations of the model to choose from")
+    parser.add_argument("--n-ctx", type=int, default=2048)
+    parser.add_argument("--budget-mb", type=int, help="memory to fit in (default: 85%% of available memory)")
+    parser.add_argument("--type-k", default="f16", choices=KV_CACHE_TYPES)
+    parser.add_argument("--type-v", default="f16", choices=KV_CACHE_TYPES)
+    args = parser.parse_args(argv)
+
+    type_k, type_v = KV_CACHE_TYPES[args.type_k], KV_CACHE_TYPES[args.type_v]
+    try:
+        for info in candidates(args.model, args.model_dir):
+            print(f"{os.path.basename(info.path)}: {info.name} ({info.architecture}), "
+                  f"{info.n_params / 1e9:.2f}B params, {info.bits_per_weight:.2f} bits/weight, "
+                  f"weights {info.weights_bytes / 2 ** 20:.0f} MB, "
+                  f"KV cache {info.kv_cache_bytes(args.n_ctx, type_k, type_v) / 2 ** 20:.0f} MB, "
+                  f"total {info.memory_bytes(args.n_ctx, type_k, type_v) / 2 ** 20:.0f} MB")
+        budget = args.budget_mb * 2 ** 20 if args.budget_mb else None
+        result = plan(args.model, args.n_ctx, budget, type_k, type_v, args.model_dir)
+    except (OSError, GGUFError, InsufficientMemoryError) as e:
+        sys.exit(str(e))
+    budget_text = f"{result.budget / 2 ** 20:.0f} MB" if result.budget else "unknown"
+    print(f"Plan: {os.path.basename(result.model_path)} with n_ctx {result.n_ctx}, "
+          f"about {result.memory_bytes / 2 ** 20:.0f} MB of {budget_text}")
+    for note in result.notes:
+        print(f"  {note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Neighbours checked per lookup, so a close match from another scope (an
+# older knowledge base, a different model) doesn't hide one from this scope
+SEARCH_K = 8
+
+
+def normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    if vector.ndim == 2:
+        # Per-token embeddings from a model without pooling: mean-pool them
+        vector = vector.mean(axis=0)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class FlatIndex:
+    """Exact cosine search over unit vectors kept in one NumPy matrix.
+
+    Removed slots are reused, so the matrix only grows to the largest number
+    of vectors held at once. Fast enough for a few hundred thousand vectors.
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.used = np.zeros(capacity, dtype=bool)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def add(self, vector: np.ndarray) -> int:
+        if not self._free:
+            capacity = len(self.vectors)
+            grow = max(1, capacity // 2)
+            self.vectors = np.concatenate([self.vectors, np.zeros((grow, self.dim), dtype=np.float32)])
+            self.used = np.concatenate([self.used, np.zeros(grow, dtype=bool)])
+            self._free = list(range(capacity + grow - 1, capacity - 1, -1))
+        slot = self._free.pop()
+        self.vectors[slot] = vector
+        self.used[slot] = True
+        return slot
+
+    def remove(self, slot: int):
+        self.used[slot] = False
+        self._free.append(slot)
+
+    def search(self, vector: np.ndarray, k: int) -> list:
+        """(slot, cosine similarity) of the k nearest vectors, best first"""
+        scores = self.vectors @ vector
+        scores[~self.used] = -np.inf
+        k = min(k, int(self.used.sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(slot), float(scores[slot])) for slot in top]
+
+
+class HnswIndex:
+    """Approximate search with hnswlib, for caches too large for FlatIndex"""
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("The 'hnsw' semantic cache backend needs hnswlib (pip install hnswlib)")
+        self.dim = dim
+        self.index = hnswlib.Index(space="ip", dim=dim)
+        self.index.init_index(max_elements=capacity, ef_construction=200, M=16, allow_replace_deleted=True)
+        self.index.set_ef(64)
+        self._count = 0
+        self._next = 0
+        self._free = []
+
+    def add(self, vector: np.ndarray) -> int:
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = self._next
+            self._next += 1
+            if self._next > self.index.get_max_elements():
+                self.index.resize_index(2 * self.index.get_max_elements())
+        self.index.add_items(vector[None, :], [slot], replace_deleted=True)
+        self._count += 1
+        return slot
+
+    def remove(self, slot: int):
+        self.index.mark_deleted(slot)
+        self._free.append(slot)
+        self._count -= 1
+
+    def search(self, vector: np.ndarray, k: int) -> list:
+        k = min(k, self._count)
+        if k == 0:
+            return []
+        labels, distances = self.index.knn_query(vector[None, :], k=k)
+        # Inner-product distance is 1 - similarity for unit vectors
+        return [(int(slot), 1.0 - float(d)) for slot, d in zip(labels[0], distances[0])]
+
+
+INDEX_BACKENDS = {"flat": FlatIndex, "hnsw": HnswIndex}
+
+
+class SemanticCache:
+    """Answers looked up by embedding similarity of the question.
+
+    A cached answer is returned when a question from the same scope (the
+    knowledge base, model and generation parameters, as for AnswerCache) has
+    cosine similarity of at least threshold. Vectors live in an index from
+    INDEX_BACKENDS; the least recently used entries are evicted once the
+    vectors and answers held take more than max_bytes.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, max_bytes: int = DEFAULT_MAX_BYTES,
+                 backend: str = "flat"):
+        if backend not in INDEX_BACKENDS:
+            raise ValueError(f"Unknown semantic cache backend {backend!r}, expected one of "
+                             f"{', '.join(INDEX_BACKENDS)}")
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.index = None
+        self.entries = {}  # slot -> [scope, question, answer, last_used]
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, vector, scope: str):
+        """Return the answer to the closest cached question in scope, or None"""
+        vector = normalize(vector)
+        with self._lock:
+            if self.index is not None and self.index.dim == len(vector):
+                for slot, score in self.index.search(vector, SEARCH_K):
+                    if score < self.threshold:
+                        break
+                    entry = self.entries[slot]
+                    if entry[0] == scope:
+                        entry[3] = time.monotonic()
+                        self.hits += 1
+                        return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, vector, scope: str, question: str, answer: str):
+        vector = normalize(vector)
+        with self._lock:
+            if self.index is None or self.index.dim != len(vector):
+                # First entry, or the embedding model changed
+                self._reset(len(vector))
+            slot = self.index.add(vector)
+            self.entries[slot] = [scope, question, answer, time.monotonic()]
+            self.bytes += self._entry_bytes(answer)
+            if self.bytes > self.max_bytes:
+                self._evict()
+
+    def _entry_bytes(self, answer: str) -> int:
+        return self.index.dim * 4 + len(answer.encode("utf-8"))
+
+    def _reset(self, dim: int = None):
+        self.index = INDEX_BACKENDS[self.backend](dim) if dim else None
+        self.entries = {}
+        self.bytes = 0
+
+    def _evict(self):
+        """Drop least recently used entries until a quarter of max_bytes is free.
+
+        Freeing more than the excess means eviction doesn't run on every put
+        once the cache is full. The newest entry is always kept.
+        """
+        target = self.max_bytes * 3 // 4
+        for slot in sorted(self.entries, key=lambda slot: self.entries[slot][3])[:-1]:
+            if self.bytes <= target:
+                break
+            answer = self.entries.pop(slot)[2]
+            self.index.remove(slot)
+            self.bytes -= self._entry_bytes(answer)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
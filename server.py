@@ -0,0 +1,296 @@
+"""HTTP front end so one loaded model can serve many clients.
+
+Implements the parts of the OpenAI API that chat clients need:
+
+    POST /v1/chat/completions   (set "stream": true for server-sent events)
+    GET  /v1/models
+    GET  /health
+    GET  /metrics
+
+Generation runs on the ai_agent inference worker; the event loop only moves
+text between that worker and the sockets.
+
+    python server.py --host 0.0.0.0 --port 8000
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+from http import HTTPStatus
+
+import ai_agent
+from metrics import RequestMetrics
+
+MODEL_NAME = "ai-agent"
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class LoopQueue:
+    """Adapter that lets the inference worker put items on an asyncio.Queue"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.in_flight = 0
+        self.errors = 0
+        self.rejected = 0
+        self.completion_tokens = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "completion_tokens": self.completion_tokens,
+            "queue_pending": ai_agent.scheduler.pending(),
+            "model_loaded": ai_agent.is_model_loaded(),
+            "answer_cache": ai_agent.answer_cache.stats(),
+            "semantic_cache": ai_agent.semantic_cache.stats(),
+            "batch": ai_agent.batch_engine.stats() if ai_agent.batch_engine else None,
+            "sessions": ai_agent.session_store.stats() if ai_agent.session_store else None,
+            "recent_requests": ai_agent.metrics_log.summary(),
+        }
+
+
+metrics = Metrics()
+
+
+def question_from_messages(messages):
+    """Split messages into the latest user message and the conversation before it"""
+    if not isinstance(messages, list):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "'messages' must be a list")
+    for position in range(len(messages) - 1, -1, -1):
+        message = messages[position]
+        if isinstance(message, dict) and message.get("role") == "user" and message.get("content"):
+            history = [
+                {"role": m["role"], "content": str(m["content"])}
+                for m in messages[:position]
+                if isinstance(m, dict) and m.get("role") in ("user", "assistant") and m.get("content")
+            ]
+            return str(message["content"]), history
+    raise HttpError(HTTPStatus.BAD_REQUEST, "'messages' contains no user message")
+
+
+async def read_request(reader: asyncio.StreamReader):
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+    if length < 0:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+async def write_head(writer: asyncio.StreamWriter, status: HTTPStatus, content_type: str, length: int = None):
+    lines = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        f"Content-Type: {content_type}",
+        "Connection: close",
+        "Access-Control-Allow-Origin: *",
+    ]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    else:
+        lines.append("Cache-Control: no-cache")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+
+async def write_json(writer: asyncio.StreamWriter, status: HTTPStatus, payload: dict):
+    body = json.dumps(payload).encode("utf-8")
+    await write_head(writer, status, "application/json", len(body))
+    writer.write(body)
+    await writer.drain()
+
+
+def completion_chunk(completion_id: str, created: int, delta: dict, finish_reason=None) -> bytes:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": MODEL_NAME,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+
+async def chat_completions(writer: asyncio.StreamWriter, body: bytes):
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON")
+    if not isinstance(request, dict):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+    question, history = question_from_messages(request.get("messages"))
+    stream = bool(request.get("stream"))
+
+    loop = asyncio.get_running_loop()
+    out = LoopQueue(loop)
+    cancel_event = threading.Event()
+    # Filled in by the inference worker; its token counts are final once the stream ends
+    answer = RequestMetrics(question)
+    try:
+        # Cache lookups touch disk, so keep them off the event loop too
+        await loop.run_in_executor(
+            None, lambda: ai_agent.submit_answer_stream(question, out, cancel_event, block=False, history=history,
+                                                        request=answer)
+        )
+    except ai_agent.QueueFullError as e:
+        metrics.rejected += 1
+        raise HttpError(HTTPStatus.TOO_MANY_REQUESTS, str(e))
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    pieces = []
+    try:
+        if stream:
+            await write_head(writer, HTTPStatus.OK, "text/event-stream")
+            writer.write(completion_chunk(completion_id, created, {"role": "assistant"}))
+
+        while True:
+            item = await out.queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            pieces.append(item)
+            if stream:
+                writer.write(completion_chunk(completion_id, created, {"content": item}))
+                await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        cancel_event.set()
+        raise
+    except Exception as e:
+        if not stream:
+            raise
+        # Headers are already sent, so report the error in the event stream
+        metrics.errors += 1
+        writer.write(f"data: {json.dumps({'error': {'message': str(e)}})}\n\n".encode("utf-8"))
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+        return
+    finally:
+        metrics.completion_tokens += answer.completion_tokens
+
+    if stream:
+        writer.write(completion_chunk(completion_id, created, {}, "stop"))
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+        return
+
+    await write_json(writer, HTTPStatus.OK, {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": MODEL_NAME,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(pieces).strip()},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": answer.prompt_tokens,
+            "completion_tokens": answer.completion_tokens,
+            "total_tokens": answer.prompt_tokens + answer.completion_tokens,
+        },
+    })
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    metrics.in_flight += 1
+    try:
+        request = await read_request(reader)
+        if request is None:
+            return
+        method, path, headers, body = request
+        metrics.requests += 1
+
+        if method == "OPTIONS":
+            await write_head(writer, HTTPStatus.NO_CONTENT, "text/plain", 0)
+        elif method == "POST" and path == "/v1/chat/completions":
+            await chat_completions(writer, body)
+        elif method == "GET" and path == "/v1/models":
+            await write_json(writer, HTTPStatus.OK, {
+                "object": "list",
+                "data": [{"id": MODEL_NAME, "object": "model", "owned_by": "local"}],
+            })
+        elif method == "GET" and path == "/health":
+            await write_json(writer, HTTPStatus.OK, {"status": "ok", "model_loaded": ai_agent.is_model_loaded()})
+        elif method == "GET" and path == "/metrics":
+            await write_json(writer, HTTPStatus.OK, metrics.snapshot())
+        else:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"No route for {method} {path}")
+    except HttpError as e:
+        await write_json(writer, e.status, {"error": {"message": str(e)}})
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except Exception as e:
+        metrics.errors += 1
+        try:
+            await write_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": {"message": str(e)}})
+        except ConnectionError:
+            pass
+    finally:
+        metrics.in_flight -= 1
+        writer.close()
+
+
+async def serve(host: str, port: int):
+    ai_agent.load_model_async()
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f"Serving on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the assistant over an OpenAI-compatible HTTP API")
+    parser.add_argument("--host", default="127.0.0.1", help="use 0.0.0.0 to accept clients on the LAN")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
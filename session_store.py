@@ -0,0 +1,228 @@
+"""Model states saved to disk so conversations resume without a full prefill.
+
+A snapshot is the llama state (KV cache and evaluated tokens) after a
+prompt, stored under the hash of the prompt tokens and a scope naming the
+model and KV cache settings. A later prompt that starts with the same tokens,
+in this process or after a restart, loads the snapshot and only evaluates
+what comes after it. The directory is kept under a disk quota by deleting the
+least recently used snapshots.
+
+The conversation shown in the app is saved alongside, so it can be picked up
+where it was left together with its state.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 * 1024
+# Prompts shorter than this are quick enough to evaluate again
+MIN_SNAPSHOT_TOKENS = 256
+# A new snapshot must cover at least this many tokens more than the best
+# one already stored for the prompt
+MIN_SNAPSHOT_GAIN = 128
+
+
+def pack_state(state) -> dict:
+    """Arrays to store for a llama_cpp.LlamaState (or the stub's StubState).
+
+    Only the evaluated tokens are kept. Scores are only needed with
+    logits_all, so a single zero row stands in for them.
+    """
+    n_tokens = state.n_tokens
+    scores = getattr(state, "scores", None)
+    n_vocab = scores.shape[1] if scores is not None and scores.ndim == 2 else 1
+    return {
+        "input_ids": np.asarray(state.input_ids[:n_tokens], dtype=np.int32),
+        "llama_state": np.frombuffer(getattr(state, "llama_state", b""), dtype=np.uint8),
+        "seed": np.int64(getattr(state, "seed", 0) or 0),
+        "n_vocab": np.int64(n_vocab),
+    }
+
+
+def unpack_state(arrays: dict, state_type, n_ctx: int):
+    """Rebuild a state of state_type from pack_state arrays for a context of n_ctx tokens"""
+    tokens = arrays["input_ids"]
+    input_ids = np.zeros(max(n_ctx, len(tokens)), dtype=np.intc)
+    input_ids[:len(tokens)] = tokens
+    llama_state = arrays["llama_state"].tobytes()
+    return state_type(
+        input_ids=input_ids,
+        scores=np.zeros((1, int(arrays["n_vocab"])), dtype=np.single),
+        n_tokens=len(tokens),
+        llama_state=llama_state,
+        llama_state_size=len(llama_state),
+        seed=int(arrays["seed"]),
+    )
+
+
+class SessionStore:
+    """Snapshots in directory with an SQLite index of their keys, sizes and last use.
+
+    Saving happens on a writer thread, so the inference worker only pays for
+    copying the state out of llama.cpp.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.restored = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._writes = queue.Queue(maxsize=2)
+        self._writer = None
+        self._queued = {}  # key -> (scope, n_tokens) of snapshots not written yet
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"),
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " key TEXT PRIMARY KEY,"
+            " scope TEXT NOT NULL,"
+            " n_tokens INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS snapshots_last_used ON snapshots (last_used)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " name TEXT PRIMARY KEY,"
+            " history TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def make_key(scope: str, tokens) -> str:
+        digest = hashlib.sha256(scope.encode("utf-8"))
+        digest.update(np.asarray(tokens, dtype=np.int32).tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def find(self, scope: str, tokens, min_tokens: int = 1, queued: bool = False):
+        """(key, n_tokens) of the longest snapshot that tokens start with, or None.
+
+        Only snapshots of at least min_tokens tokens are considered. queued
+        includes snapshots still waiting to be written, which can't be loaded yet.
+        """
+        with self._lock:
+            lengths = {row[0] for row in self._conn.execute(
+                "SELECT DISTINCT n_tokens FROM snapshots WHERE scope = ? AND n_tokens BETWEEN ? AND ?",
+                (scope, min_tokens, len(tokens)))}
+            if queued:
+                lengths.update(n for s, n in self._queued.values() if s == scope and min_tokens <= n <= len(tokens))
+            for n in sorted(lengths, reverse=True):
+                key = self.make_key(scope, tokens[:n])
+                if (queued and key in self._queued) or \
+                        self._conn.execute("SELECT 1 FROM snapshots WHERE key = ?", (key,)).fetchone():
+                    return key, n
+        return None
+
+    def load(self, key: str):
+        """The pack_state arrays of snapshot key, or None if it is gone or unreadable"""
+        try:
+            with np.load(self._path(key)) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError) as e:
+            logging.getLogger(__name__).warning("Dropping unreadable session snapshot %s: %s", key, e)
+            self.remove(key)
+            return None
+        with self._lock:
+            self._conn.execute("UPDATE snapshots SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.restored += 1
+        return arrays
+
+    def save(self, scope: str, tokens, arrays: dict):
+        """Queue arrays to be stored as the snapshot for prompt tokens.
+
+        Dropped when the writer is still busy with earlier snapshots; the next
+        turn of the conversation will save a longer one anyway.
+        """
+        key = self.make_key(scope, tokens)
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+                self._writer.start()
+            try:
+                self._writes.put_nowait((key, scope, len(tokens), arrays))
+            except queue.Full:
+                return
+            self._queued[key] = (scope, len(tokens))
+
+    def _write_loop(self):
+        while True:
+            key, scope, n_tokens, arrays = self._writes.get()
+            try:
+                self._write(key, scope, n_tokens, arrays)
+            except Exception as e:
+                # A full disk shouldn't take the app down; the snapshot is just skipped
+                logging.getLogger(__name__).warning("Could not save session snapshot: %s", e)
+            finally:
+                with self._lock:
+                    self._queued.pop(key, None)
+
+    def _write(self, key: str, scope: str, n_tokens: int, arrays: dict):
+        path = self._path(key)
+        temp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temp, **arrays)
+        os.replace(temp, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snapshots (key, scope, n_tokens, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, scope, n_tokens, size, time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used snapshots until they fit in max_bytes. The newest is kept."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM snapshots").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM snapshots ORDER BY last_used").fetchall()
+        for key, size in rows[:-1]:
+            if total <= self.max_bytes:
+                break
+            self._delete(key)
+            total -= size
+
+    def _delete(self, key: str):
+        self._conn.execute("DELETE FROM snapshots WHERE key = ?", (key,))
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def remove(self, key: str):
+        with self._lock:
+            self._delete(key)
+
+    def save_conversation(self, name: str, history: list):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations (name, history, updated) VALUES (?, ?, ?)",
+                (name, json.dumps(history), time.time()),
+            )
+
+    def load_conversation(self, name: str) -> list:
+        with self._lock:
+            row = self._conn.execute("SELECT history FROM conversations WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def clear(self):
+        with self._lock:
+            for (key,) in self._conn.execute("SELECT key FROM snapshots").fetchall():
+                self._delete(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM snapshots").fetchone()
+            return {"entries": entries, "bytes": size, "restored": self.restored}
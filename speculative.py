@@ -0,0 +1,78 @@
+"""Speculative decoding with a small draft model.
+
+The draft model greedily proposes the next few tokens and the main model
+checks all of them in one batch, keeping the ones it would have generated
+itself. Verification is done by llama_cpp.Llama (draft_model=...), so the
+answer is exactly what the main model produces on its own under greedy
+sampling; only the number of full-model forward passes changes.
+"""
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel
+
+
+class DraftModel(LlamaDraftModel):
+    """Proposes num_pred_tokens tokens per step from a small GGUF model.
+
+    The draft model keeps its own KV cache; Llama.generate reuses the common
+    prefix with the previous call, so each step only evaluates the tokens the
+    main model accepted since then. Proposals are compared with what the main
+    model actually kept to count the acceptance rate.
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 8, **kwargs):
+        self.model = Llama(model_path=model_path, verbose=False, **kwargs)
+        self.num_pred_tokens = num_pred_tokens
+        self.proposed = 0
+        self.accepted = 0
+        self._last_start = None
+        self._last_proposal = []
+
+    def check_vocab(self, main: Llama):
+        if self.model.n_vocab() != main.n_vocab():
+            raise ValueError(
+                f"Draft model vocabulary ({self.model.n_vocab()} tokens) does not match "
+                f"the main model ({main.n_vocab()} tokens)"
+            )
+
+    def begin(self):
+        """Start counting a new request"""
+        self.proposed = 0
+        self.accepted = 0
+        self._last_start = None
+        self._last_proposal = []
+
+    def _settle(self, input_ids):
+        """Count how much of the previous proposal the main model kept"""
+        if self._last_start is None:
+            return
+        kept = input_ids[self._last_start:self._last_start + len(self._last_proposal)]
+        accepted = 0
+        for drafted, actual in zip(self._last_proposal, kept):
+            if drafted != actual:
+                break
+            accepted += 1
+        self.proposed += len(self._last_proposal)
+        self.accepted += accepted
+        self._last_start = None
+
+    def __call__(self, input_ids, /, **kwargs):
+        tokens = [int(t) for t in input_ids]
+        self._settle(tokens)
+
+        proposal = []
+        if len(tokens) + self.num_pred_tokens < self.model.n_ctx():
+            generator = self.model.generate(tokens, temp=0.0)
+            try:
+                for token in generator:
+                    if token == self.model.token_eos():
+                        break
+                    proposal.append(token)
+                    if len(proposal) >= self.num_pred_tokens:
+                        break
+            finally:
+                generator.close()
+
+        self._last_start = len(tokens)
+        self._last_proposal = proposal
+        return np.array(proposal, dtype=np.intc)
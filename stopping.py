@@ -0,0 +1,146 @@
+"""Ending answers early while they stream.
+
+The model often runs on after the answer: filler, a made-up next turn of
+the conversation, or blank lines until max_tokens. StopRules checks every
+streamed piece against stop strings, regular expressions and, for short
+factual questions, a sentence limit, and generation stops at the first
+match. Questions are matched to an intent that sets its own token budget.
+"""
+import re
+
+# Regular expressions that end an answer where they match; the match itself
+# is dropped. These catch the model writing the next turn or trailing off.
+DEFAULT_STOP_PATTERNS = [
+    r"\n\s*(?:User|You|Human|Customer|Assistant)\s*:",
+    r"\n\s*\n\s*\n",
+]
+# A pattern match is only removed from the streamed text if it completes
+# within this many characters of its start; longer matches still stop it
+PATTERN_HOLDBACK = 16
+
+# End of a sentence: punctuation followed by whitespace, except after a
+# single letter ("e.g. ", "U.S. ") or a list number at the start of a line
+SENTENCE_END = re.compile(r"(?<!\b[A-Za-z])(?<!^\d)(?<!\n\d)[.!?](?=\s)")
+
+
+class Intent:
+    """A kind of question, recognised by pattern, with its own length limits"""
+
+    def __init__(self, name: str, pattern: str, max_tokens: int, max_sentences: int = None):
+        self.name = name
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.max_tokens = max_tokens
+        self.max_sentences = max_sentences
+
+    def describe(self) -> list:
+        return [self.name, self.pattern.pattern, self.max_tokens, self.max_sentences]
+
+
+DEFAULT_INTENTS = [
+    Intent("greeting", r"^\W*(?:hi|hello|hey|thanks|thank you|good (?:morning|afternoon|evening))\b", 48, 2),
+    Intent("factual", r"\b(?:when|where|what time|how (?:much|long|many)|hours|open|close|address|phone|e-?mail"
+                      r"|contact|price|cost)\b", 96, 3),
+]
+
+
+class Terminator:
+    """Tracks one streamed answer and decides where it ends.
+
+    feed() takes each new piece of text and returns the part that is safe to
+    show, holding back a tail that could still turn into a stop string or
+    pattern match, plus whether generation should stop. reason says which
+    rule ended it.
+    """
+
+    def __init__(self, stop=(), patterns=(), max_sentences: int = None):
+        self.stop = [s for s in stop if s]
+        self.patterns = [re.compile(p) if isinstance(p, str) else p for p in patterns]
+        self.max_sentences = max_sentences
+        self.text = ""
+        self.emitted = 0
+        self.reason = None
+
+    def _cut(self):
+        """(position, reason) of the earliest rule match in text, or None"""
+        cut = None
+        for stop in self.stop:
+            position = self.text.find(stop)
+            if position != -1 and (cut is None or position < cut[0]):
+                cut = position, "stop"
+        for pattern in self.patterns:
+            match = pattern.search(self.text)
+            if match and (cut is None or match.start() < cut[0]):
+                cut = match.start(), "pattern"
+        if self.max_sentences:
+            for count, match in enumerate(SENTENCE_END.finditer(self.text), 1):
+                if count == self.max_sentences:
+                    if cut is None or match.end() < cut[0]:
+                        cut = match.end(), "sentences"
+                    break
+        return cut
+
+    def feed(self, piece: str, final: bool = False) -> tuple:
+        self.text += piece
+        cut = self._cut()
+        if cut is not None:
+            position, self.reason = cut
+            self.text = self.text[:position]
+            emit, self.emitted = self.text[self.emitted:], max(self.emitted, position)
+            return emit, True
+
+        safe = len(self.text)
+        if not final:
+            for stop in self.stop:
+                # Longest tail of text that stop starts with
+                tail = self.text[1 - len(stop):] if len(stop) > 1 else ""
+                start = tail.find(stop[0])
+                while start != -1:
+                    if stop.startswith(tail[start:]):
+                        safe = min(safe, len(self.text) - len(tail) + start)
+                        break
+                    start = tail.find(stop[0], start + 1)
+            if self.patterns:
+                safe = min(safe, len(self.text) - PATTERN_HOLDBACK)
+        safe = max(self.emitted, safe)
+        emit, self.emitted = self.text[self.emitted:safe], safe
+        return emit, False
+
+
+class StopRules:
+    """Stop strings, patterns and intents applied to every answer.
+
+    With a grammar the output has to stay valid (e.g. complete JSON), so
+    only the token budget applies.
+    """
+
+    def __init__(self, stop=(), patterns=DEFAULT_STOP_PATTERNS, intents=DEFAULT_INTENTS, grammar: bool = False):
+        self.stop = list(stop)
+        self.patterns = list(patterns)
+        self.intents = list(intents)
+        self.grammar = grammar
+
+    def intent(self, question: str):
+        """The first intent matching question, or None"""
+        for intent in self.intents:
+            if intent.pattern.search(question):
+                return intent
+        return None
+
+    def start(self, question: str, max_tokens: int) -> tuple:
+        """(Terminator, token budget) for answering question with at most max_tokens"""
+        if self.grammar:
+            return Terminator(), max_tokens
+        intent = self.intent(question)
+        if intent is None:
+            return Terminator(self.stop, self.patterns), max_tokens
+        return (Terminator(self.stop, self.patterns, intent.max_sentences),
+                min(max_tokens, intent.max_tokens))
+
+    def describe(self) -> list:
+        """Everything that changes the answers, for cache keys"""
+        return [self.stop, self.patterns, [i.describe() for i in self.intents], self.grammar]
+
+
+def intents_from_config(entries: list) -> list:
+    """Intents from a profile's [[intents]] tables (name, pattern, max_tokens, max_sentences)"""
+    return [Intent(e["name"], e["pattern"], e["max_tokens"], e.get("max_sentences")) for e in entries]
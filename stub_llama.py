@@ -0,0 +1,222 @@
+"""Deterministic stand-in for llama_cpp.Llama that needs no model file.
+
+It implements the parts of the Llama API that ai_agent uses and sleeps for a
+configurable time per prompt token (prefill) and per generated token (decode),
+so benchmarks and load tests behave like a real model without the weights.
+"""
+import re
+import time
+import zlib
+
+import numpy as np
+
+_PIECE = re.compile(rb"\s*\S+|\s+")
+
+_WORDS = (
+    "our", "team", "is", "happy", "to", "help", "you", "with", "that", "the",
+    "office", "opens", "at", "nine", "and", "closes", "five", "on", "weekdays",
+    "please", "contact", "support", "for", "more", "details", "about", "orders",
+)
+
+
+def _sleep(ms: float):
+    # Even time.sleep(0) costs tens of microseconds, which adds up in load tests
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+class StubState:
+    def __init__(self, input_ids, n_tokens, **kwargs):
+        self.input_ids = list(input_ids)
+        self.n_tokens = n_tokens
+
+
+class StubBatchContext:
+    """Multi-sequence context for batch_engine.BatchEngine over a StubLlama.
+
+    A step costs prefill_ms_per_token per prompt token plus one decode step
+    that gets 15% slower for every extra sequence in it, roughly how batched
+    decoding behaves on a memory-bandwidth-bound CPU.
+    """
+
+    def __init__(self, model, n_seq: int, n_ctx: int):
+        self.model = model
+        self.n_ctx = n_ctx
+        self.n_batch = 512
+        self.cells = {}  # seq -> tokens at positions 0..n-1
+        self.answers = {}  # seq -> (prompt length, answer tokens)
+
+    def decode(self, entries: list) -> list:
+        if sum(len(tokens) for tokens in self.cells.values()) + len(entries) > self.n_ctx:
+            raise RuntimeError("llama_decode returned 1")
+        decoding = sum(1 for token, position, seq, logits in entries
+                       if logits and position >= self.answers.get(seq, (1 << 30,))[0])
+        prefill = len(entries) - decoding
+        _sleep(prefill * self.model.prefill_ms_per_token
+               + (self.model.decode_ms_per_token * (1 + 0.15 * (decoding - 1)) if decoding else 0))
+
+        rows = []
+        for token, position, seq, logits in entries:
+            tokens = self.cells.setdefault(seq, [])
+            del tokens[position:]
+            tokens.append(token)
+            if not logits:
+                continue
+            if seq not in self.answers:
+                self.answers[seq] = (len(tokens), self.model._answer_tokens(tokens))
+            prompt_length, answer = self.answers[seq]
+            index = len(tokens) - prompt_length
+            row = np.full(self.model.n_vocab(), -1e9, dtype=np.float32)
+            row[answer[index] if index < len(answer) else StubLlama.EOS] = 0.0
+            rows.append(row)
+        return rows
+
+    def seq_rm(self, seq: int):
+        self.cells.pop(seq, None)
+        self.answers.pop(seq, None)
+
+    def seq_cp(self, src: int, dst: int, p0: int, p1: int):
+        self.cells[dst] = list(self.cells.get(src, [])[p0:p1])
+
+    def is_eog(self, token: int) -> bool:
+        return token == StubLlama.EOS
+
+    def token_bytes(self, token: int) -> bytes:
+        return self.model._pieces.get(token, b"")
+
+
+class StubLlama:
+    BOS = 1
+    EOS = 2
+    N_VOCAB = 32000
+
+    def __init__(self, model_path: str = "stub", n_ctx: int = 2048, n_threads: int = None,
+                 prefill_ms_per_token: float = 0.05, decode_ms_per_token: float = 2.0,
+                 answer_tokens: int = 40, **kwargs):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+        self.answer_tokens = answer_tokens
+        self.input_ids = []
+        self.n_tokens = 0
+        self._pieces = {self.BOS: b"", self.EOS: b""}
+        self._ids = {}
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def token_bos(self) -> int:
+        return self.BOS
+
+    def token_eos(self) -> int:
+        return self.EOS
+
+    def n_vocab(self) -> int:
+        return self.N_VOCAB
+
+    def _token_id(self, piece: bytes) -> int:
+        token = self._ids.get(piece)
+        if token is None:
+            # Derived from the piece, so token ids mostly agree between
+            # processes. Pieces whose hashes collide get ids in the order they
+            # are first seen, which can differ from one process to the next.
+            token = 3 + zlib.crc32(piece) % (self.N_VOCAB - 3)
+            while token in self._pieces:
+                token = 3 + (token - 2) % (self.N_VOCAB - 3)
+            self._ids[piece] = token
+            self._pieces[token] = piece
+        return token
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> list:
+        tokens = [self.BOS] if add_bos else []
+        tokens += [self._token_id(piece) for piece in _PIECE.findall(text)]
+        return tokens
+
+    def detokenize(self, tokens, prev_tokens=None, special: bool = False) -> bytes:
+        return b"".join(self._pieces.get(token, b"") for token in tokens)
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        if self.n_tokens + len(tokens) > self._n_ctx:
+            raise ValueError(f"Requested tokens ({self.n_tokens + len(tokens)}) exceed context window of {self._n_ctx}")
+        _sleep(len(tokens) * self.prefill_ms_per_token)
+        self.input_ids = self.input_ids[:self.n_tokens] + list(tokens)
+        self.n_tokens += len(tokens)
+
+    def save_state(self) -> StubState:
+        return StubState(self.input_ids[:self.n_tokens], self.n_tokens)
+
+    def load_state(self, state: StubState):
+        self.input_ids = list(state.input_ids)
+        self.n_tokens = state.n_tokens
+
+    def _prefill(self, tokens):
+        """Evaluate tokens, reusing the longest prefix already in the context"""
+        reuse = 0
+        for a, b in zip(self.input_ids[:self.n_tokens], tokens):
+            if a != b:
+                break
+            reuse += 1
+        # Like llama.cpp, always evaluate at least one token to get fresh logits
+        self.n_tokens = min(reuse, len(tokens) - 1)
+        self.eval(tokens[self.n_tokens:])
+
+    def _answer_tokens(self, prompt_tokens) -> list:
+        seed = zlib.crc32(repr(prompt_tokens[-32:]).encode())
+        words = [_WORDS[(seed + i * 7) % len(_WORDS)] for i in range(self.answer_tokens)]
+        text = " " + " ".join(words) + ".\nUser: next question"
+        return self.tokenize(text.encode("utf-8"), add_bos=False)
+
+    def _generate(self, prompt, max_tokens: int, stop):
+        tokens = prompt if isinstance(prompt, list) else self.tokenize(prompt.encode("utf-8"), special=True)
+        if len(tokens) + max_tokens > self._n_ctx:
+            raise ValueError(f"Requested tokens ({len(tokens) + max_tokens}) exceed context window of {self._n_ctx}")
+        self._prefill(tokens)
+
+        stop = [stop] if isinstance(stop, str) else (stop or [])
+        text = b""
+        for token in self._answer_tokens(tokens)[:max_tokens]:
+            _sleep(self.decode_ms_per_token)
+            self.eval_generated(token)
+            piece = self._pieces[token]
+            candidate = (text + piece).decode("utf-8", "ignore")
+            if any(s in candidate for s in stop):
+                return
+            text += piece
+            yield piece.decode("utf-8", "ignore")
+
+    def eval_generated(self, token: int):
+        del self.input_ids[self.n_tokens:]
+        self.input_ids.append(token)
+        self.n_tokens += 1
+
+    def embed(self, text: str, normalize: bool = False, **kwargs) -> list:
+        """Hashed bag-of-words vector, so questions sharing words come out similar"""
+        vector = [0.0] * 64
+        for word in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(word.encode()) % 64] += 1.0
+        _sleep(len(self.tokenize(text.encode("utf-8"))) * self.prefill_ms_per_token)
+        return vector
+
+    def __call__(self, prompt, max_tokens: int = 16, stop=None, stream: bool = False, **kwargs):
+        return self.create_completion(prompt, max_tokens=max_tokens, stop=stop, stream=stream, **kwargs)
+
+    def create_completion(self, prompt, max_tokens: int = 16, stop=None, stream: bool = False, **kwargs):
+        pieces = self._generate(prompt, max_tokens, stop)
+        if stream:
+            return ({"choices": [{"text": piece, "index": 0, "finish_reason": None}]} for piece in pieces)
+
+        pieces = list(pieces)
+        prompt_tokens = len(prompt) if isinstance(prompt, list) else len(self.tokenize(prompt.encode("utf-8")))
+        return {
+            "choices": [{"text": "".join(pieces), "index": 0, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(pieces),
+                "total_tokens": prompt_tokens + len(pieces),
+            },
+        }
@@ -0,0 +1,44 @@
+_UNSET = object()
+
+
+class StyleBinding:
+    """Options of one widget (or text tag) and the state keys they depend on"""
+
+    def __init__(self, configure, depends_on, options: dict):
+        self.configure = configure
+        self.depends_on = frozenset(depends_on)
+        self.options = options
+        self.applied = {}
+
+
+class StyleRegistry:
+    """Widget options computed from app state and applied only when they change.
+
+    Each binding names the state keys it depends on ("theme", "scale", ...),
+    a configure function (widget.configure, a tag_configure partial, ...) and
+    a function per option that computes its current value. apply(*keys)
+    re-evaluates only the bindings that depend on those keys and passes each
+    configure function only the options whose value differs from the last one
+    it was given.
+    """
+
+    def __init__(self):
+        self.bindings = []
+
+    def bind(self, configure, depends_on, **options):
+        self.bindings.append(StyleBinding(configure, depends_on, options))
+
+    def apply(self, *keys):
+        """Apply bindings that depend on any of keys (all bindings if none are given)"""
+        keys = frozenset(keys)
+        for binding in self.bindings:
+            if keys and not binding.depends_on & keys:
+                continue
+            changed = {}
+            for name, resolve in binding.options.items():
+                value = resolve()
+                if binding.applied.get(name, _UNSET) != value:
+                    changed[name] = value
+            if changed:
+                binding.configure(**changed)
+                binding.applied.update(changed)
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STUB_PROFILE = """
+default_profile = "test"
+
+[profiles.test]
+backend = "stub"
+prefill_ms_per_token = 0.0
+decode_ms_per_token = 5.0
+answer_tokens = 40
+sessions = false
+semantic_cache = false
+"""
+
+COMPANY_INFO = """Our office opens at nine and closes at five on weekdays.
+
+Orders ship within two days. Refunds are paid back to the original card.
+"""
+
+
+@pytest.fixture(scope="session")
+def agent(tmp_path_factory):
+    """ai_agent on the stub backend, with its files in a temporary directory"""
+    directory = tmp_path_factory.mktemp("agent")
+    (directory / "ai_agent.toml").write_text(STUB_PROFILE)
+    (directory / "company_info.txt").write_text(COMPANY_INFO)
+    os.environ["AI_AGENT_CONFIG"] = str(directory / "ai_agent.toml")
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import ai_agent
+
+        yield ai_agent
+    finally:
+        os.chdir(cwd)
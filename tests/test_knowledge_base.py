@@ -0,0 +1,87 @@
+from knowledge_base import KnowledgeBase
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def snapshot_of(tmp_path, text: str):
+    path = tmp_path / "info.txt"
+    path.write_text(text)
+    knowledge_base = KnowledgeBase(str(path), index_path=str(tmp_path / "info.index.npz"))
+    knowledge_base.refresh()
+    return knowledge_base.snapshot
+
+
+PARAGRAPHS = [
+    "Our office opens at nine and closes at five on weekdays. " * 10,
+    "Orders ship within two days from the warehouse in Leeds. " * 10,
+    "Refunds are paid back to the original card within a week. " * 10,
+]
+
+
+def test_whole_text_is_used_when_it_fits(tmp_path):
+    snapshot = snapshot_of(tmp_path, "\n\n".join(PARAGRAPHS))
+    info, is_whole = snapshot.context("when do orders ship", 1000, count_words)
+    assert is_whole
+    assert info == snapshot.text
+
+
+def test_matching_passages_are_used_within_the_budget(tmp_path):
+    snapshot = snapshot_of(tmp_path, "\n\n".join(PARAGRAPHS))
+    budget = count_words(PARAGRAPHS[2]) + 5
+    info, is_whole = snapshot.context("refunds to my card", budget, count_words)
+    assert not is_whole
+    assert "Refunds" in info
+    assert "warehouse" not in info
+    assert count_words(info) <= budget
+
+
+def test_passages_are_returned_in_document_order(tmp_path):
+    snapshot = snapshot_of(tmp_path, "\n\n".join(PARAGRAPHS))
+    budget = count_words(PARAGRAPHS[0]) + count_words(PARAGRAPHS[2]) + 10
+    info, _ = snapshot.context("refunds card office nine", budget, count_words)
+    assert info.index("office") < info.index("Refunds")
+
+
+def test_without_matches_the_first_passages_are_used(tmp_path):
+    snapshot = snapshot_of(tmp_path, "\n\n".join(PARAGRAPHS))
+    budget = count_words(PARAGRAPHS[0]) + 5
+    info, is_whole = snapshot.context("xyzzy", budget, count_words)
+    assert not is_whole
+    assert info.startswith("Our office opens")
+
+
+def test_refresh_picks_up_edits(tmp_path):
+    path = tmp_path / "info.txt"
+    path.write_text(PARAGRAPHS[0])
+    knowledge_base = KnowledgeBase(str(path), index_path=str(tmp_path / "info.index.npz"))
+    changes = []
+    knowledge_base.on_change(changes.append)
+    assert knowledge_base.refresh()
+    old = knowledge_base.snapshot
+
+    assert not knowledge_base.refresh()
+    path.write_text(PARAGRAPHS[0] + "\n\n" + PARAGRAPHS[2])
+    assert knowledge_base.refresh()
+
+    assert "Refunds" in knowledge_base.text
+    assert knowledge_base.digest != old.digest
+    assert changes[-1] is knowledge_base.snapshot
+    # A request holding the old snapshot keeps answering from the old text
+    assert "Refunds" not in old.text
+
+
+def test_documents_in_a_directory_are_joined(tmp_path):
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "a.txt").write_text(PARAGRAPHS[0])
+    (tmp_path / "docs" / "b.md").write_text(PARAGRAPHS[1])
+    (tmp_path / "docs" / "ignored.bin").write_text("binary")
+    knowledge_base = KnowledgeBase(str(tmp_path / "docs"), index_path=str(tmp_path / "docs.index.npz"))
+    knowledge_base.refresh()
+    assert knowledge_base.text.index("office") < knowledge_base.text.index("warehouse")
+    assert "binary" not in knowledge_base.text
+
+    (tmp_path / "docs" / "a.txt").unlink()
+    assert knowledge_base.refresh()
+    assert "office" not in knowledge_base.text
@@ -0,0 +1,83 @@
+import struct
+
+import pytest
+
+from model_planner import MIN_N_CTX, InsufficientMemoryError, plan, read_gguf
+
+WEIGHTS_BYTES = 1024 * 1024
+# 32 layers x 8 KV heads x (128 key + 128 value) f16 values per token
+KV_BYTES_PER_TOKEN = 32 * 8 * (128 * 2 + 128 * 2)
+
+
+def gguf_string(text):
+    data = text.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def gguf_kv(key, value):
+    if isinstance(value, str):
+        return gguf_string(key) + struct.pack("<I", 8) + gguf_string(value)
+    return gguf_string(key) + struct.pack("<II", 4, value)
+
+
+def write_gguf(path):
+    """A GGUF header for a small llama model, followed by WEIGHTS_BYTES of zeros"""
+    metadata = [
+        gguf_kv("general.architecture", "llama"),
+        gguf_kv("general.name", "Tiny"),
+        gguf_kv("llama.block_count", 32),
+        gguf_kv("llama.embedding_length", 4096),
+        gguf_kv("llama.attention.head_count", 32),
+        gguf_kv("llama.attention.head_count_kv", 8),
+        gguf_kv("llama.context_length", 8192),
+        gguf_kv("llama.vocab_size", 1000),
+    ]
+    # One 4096 x 256 tensor: name, dimensions, type and data offset
+    tensor = gguf_string("token_embd.weight") + struct.pack("<IQQIQ", 2, 4096, 256, 0, 0)
+    header = b"GGUF" + struct.pack("<IQQ", 3, 1, len(metadata)) + b"".join(metadata) + tensor
+    padding = -len(header) % 32
+    path.write_bytes(header + b"\0" * (padding + WEIGHTS_BYTES))
+    return str(path)
+
+
+def test_header_is_read_without_the_weights(tmp_path):
+    info = read_gguf(write_gguf(tmp_path / "tiny.gguf"))
+
+    assert info.architecture == "llama"
+    assert info.name == "Tiny"
+    assert (info.n_layer, info.n_embd, info.n_head, info.n_head_kv) == (32, 4096, 32, 8)
+    assert info.context_length == 8192
+    assert info.n_vocab == 1000
+    assert info.n_params == 4096 * 256
+    assert info.data_offset % 32 == 0
+    assert info.weights_bytes == WEIGHTS_BYTES
+
+
+def test_kv_cache_estimate(tmp_path):
+    info = read_gguf(write_gguf(tmp_path / "tiny.gguf"))
+
+    assert info.kv_cache_bytes(2048) == 2048 * KV_BYTES_PER_TOKEN
+    # q8_0 keys take 34 bytes per block of 32 values instead of 64
+    assert info.kv_cache_bytes(2048, type_k=8) == 2048 * 32 * 8 * (128 * 34 / 32 + 128 * 2)
+    assert info.memory_bytes(4096) - info.memory_bytes(2048) == 2048 * KV_BYTES_PER_TOKEN
+
+
+def test_n_ctx_is_halved_until_the_model_fits(tmp_path):
+    path = write_gguf(tmp_path / "tiny.gguf")
+    info = read_gguf(path)
+
+    fits = plan(path, 4096, budget=info.memory_bytes(4096))
+    assert fits.n_ctx == 4096 and fits.notes == []
+
+    halved = plan(path, 4096, budget=info.memory_bytes(1024) + 1)
+    assert halved.n_ctx == 1024
+    assert halved.memory_bytes <= halved.budget
+    assert "n_ctx lowered from 4096 to 1024 to fit in memory" in halved.notes
+
+
+def test_refuses_a_model_that_does_not_fit(tmp_path):
+    path = write_gguf(tmp_path / "tiny.gguf")
+    info = read_gguf(path)
+
+    with pytest.raises(InsufficientMemoryError):
+        plan(path, 4096, budget=info.memory_bytes(MIN_N_CTX) - 1)
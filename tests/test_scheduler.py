@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+
+def test_cancelled_pending_request_never_runs(agent):
+    scheduler = agent.InferenceScheduler(max_pending=4)
+    release = threading.Event()
+    ran = []
+    first = scheduler.submit(lambda: release.wait(5) and ran.append("first"))
+    second = scheduler.submit(lambda: ran.append("second"))
+
+    assert second.cancel()
+    release.set()
+    first.result(timeout=5)
+    scheduler.submit(lambda: None).result(timeout=5)
+    assert ran == ["first"]
+
+
+def test_full_queue_raises_without_blocking(agent):
+    scheduler = agent.InferenceScheduler(max_pending=1)
+    release = threading.Event()
+    scheduler.submit(release.wait, 5)
+    try:
+        with pytest.raises(agent.QueueFullError):
+            # One request running, one waiting, so the next doesn't fit
+            for _ in range(3):
+                scheduler.submit(release.wait, 5, block=False)
+    finally:
+        release.set()
+
+
+def test_cancelling_a_stream_stops_generation(agent):
+    question = "tell me about the opening hours of the office"
+    cancel_event = threading.Event()
+    pieces = []
+    for piece in agent.stream_answer(question, cancel_event):
+        pieces.append(piece)
+        cancel_event.set()
+
+    record = agent.metrics_log.last()
+    assert record["cancelled"]
+    assert record["completion_tokens"] < 40
+    assert len(pieces) < 5
+    # A cut-off answer must not be served from the cache later
+    assert agent.answer_cache.get(agent.answer_cache_key(question)) is None
+
+
+def test_stream_without_cancel_is_complete_and_cached(agent):
+    question = "where do orders ship from"
+    answer = "".join(agent.stream_answer(question))
+    assert answer
+    assert not agent.metrics_log.last()["cancelled"]
+    assert agent.answer_cache.get(agent.answer_cache_key(question)) == answer.strip()
@@ -0,0 +1,85 @@
+import os
+import time
+
+from session_store import SessionStore, pack_state, unpack_state
+from stub_llama import StubState
+
+SCOPE = "stub"
+
+
+def arrays_for(tokens):
+    return pack_state(StubState(tokens, len(tokens)))
+
+
+def save_and_wait(store, tokens):
+    """Save a snapshot of tokens and wait for the writer thread to store it"""
+    store.save(SCOPE, tokens, arrays_for(tokens))
+    deadline = time.monotonic() + 5
+    while store.find(SCOPE, tokens, len(tokens)) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert store.find(SCOPE, tokens, len(tokens)) is not None
+
+
+def test_find_returns_the_longest_saved_prefix(tmp_path):
+    store = SessionStore(str(tmp_path))
+    tokens = list(range(100))
+    save_and_wait(store, tokens[:20])
+    save_and_wait(store, tokens[:60])
+
+    assert store.find(SCOPE, tokens) == (store.make_key(SCOPE, tokens[:60]), 60)
+    assert store.find(SCOPE, tokens[:50]) == (store.make_key(SCOPE, tokens[:20]), 20)
+    assert store.find(SCOPE, tokens, min_tokens=61) is None
+    assert store.find("other model", tokens) is None
+    assert store.find(SCOPE, [5] + tokens[1:]) is None
+
+
+def test_loaded_state_has_the_saved_tokens(tmp_path):
+    store = SessionStore(str(tmp_path))
+    tokens = list(range(1, 40))
+    save_and_wait(store, tokens)
+    key, n = store.find(SCOPE, tokens)
+    state = unpack_state(store.load(key), StubState, 64)
+    assert state.n_tokens == n == len(tokens)
+    assert list(state.input_ids[:n]) == tokens
+    assert store.stats()["restored"] == 1
+
+
+def test_least_recently_used_snapshots_are_evicted(tmp_path):
+    store = SessionStore(str(tmp_path))
+    first, second, third = list(range(50)), list(range(100, 150)), list(range(200, 250))
+    save_and_wait(store, first)
+    size = store.stats()["bytes"]
+    store.max_bytes = size * 2 + size // 2
+
+    save_and_wait(store, second)
+    time.sleep(0.01)
+    # Using the first snapshot makes the second the least recently used
+    store.load(store.find(SCOPE, first)[0])
+    time.sleep(0.01)
+    save_and_wait(store, third)
+
+    assert store.stats()["entries"] == 2
+    assert store.find(SCOPE, second) is None
+    assert store.find(SCOPE, first) is not None
+    assert store.find(SCOPE, third) is not None
+    assert not os.path.exists(os.path.join(str(tmp_path), store.make_key(SCOPE, second) + ".npz"))
+
+
+def test_unreadable_snapshot_is_dropped(tmp_path):
+    store = SessionStore(str(tmp_path))
+    tokens = list(range(30))
+    save_and_wait(store, tokens)
+    key, _ = store.find(SCOPE, tokens)
+    with open(os.path.join(str(tmp_path), key + ".npz"), "wb") as f:
+        f.write(b"not a snapshot")
+
+    assert store.load(key) is None
+    assert store.find(SCOPE, tokens) is None
+
+
+def test_conversations_round_trip(tmp_path):
+    store = SessionStore(str(tmp_path))
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    store.save_conversation("default", history)
+    assert SessionStore(str(tmp_path)).load_conversation("default") == history
+    assert store.load_conversation("other") == []
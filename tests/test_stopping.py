@@ -0,0 +1,62 @@
+from stopping import DEFAULT_STOP_PATTERNS, Intent, StopRules, Terminator
+
+
+def feed_all(terminator, pieces):
+    """Feed pieces as a stream would and return (emitted text, stopped)"""
+    emitted = []
+    for piece in pieces:
+        text, stopped = terminator.feed(piece)
+        emitted.append(text)
+        if stopped:
+            return "".join(emitted), True
+    emitted.append(terminator.feed("", final=True)[0])
+    return "".join(emitted), False
+
+
+def test_stop_string_split_across_pieces_is_not_emitted():
+    terminator = Terminator(stop=["User:"])
+    text, stopped = feed_all(terminator, ["Hello there.\nUs", "er: next"])
+    assert stopped
+    assert terminator.reason == "stop"
+    assert text == "Hello there.\n"
+
+
+def test_held_back_text_is_emitted_at_the_end():
+    terminator = Terminator(stop=["User:"])
+    text, stopped = feed_all(terminator, ["We open at nine. Us"])
+    assert not stopped
+    assert text == "We open at nine. Us"
+
+
+def test_pattern_stops_at_next_turn():
+    terminator = Terminator(patterns=DEFAULT_STOP_PATTERNS)
+    text, stopped = feed_all(terminator, ["We ship in two days.", "\nCustomer", ": thanks"])
+    assert stopped
+    assert terminator.reason == "pattern"
+    assert text == "We ship in two days."
+
+
+def test_sentence_limit_ignores_abbreviations():
+    terminator = Terminator(max_sentences=2)
+    text, stopped = feed_all(terminator, ["Pay by card, e.g. Visa. ", "Refunds take a week. ", "Thanks."])
+    assert stopped
+    assert terminator.reason == "sentences"
+    assert text == "Pay by card, e.g. Visa. Refunds take a week."
+
+
+def test_intent_sets_budget_and_sentences():
+    rules = StopRules(intents=[Intent("factual", r"\bhours\b", 64, 1)])
+    terminator, budget = rules.start("What are your hours?", 200)
+    assert budget == 64
+    assert feed_all(terminator, ["Nine to five. Weekdays only."]) == ("Nine to five.", True)
+
+    terminator, budget = rules.start("Tell me a story", 200)
+    assert budget == 200
+    assert terminator.max_sentences is None
+
+
+def test_grammar_only_keeps_the_budget():
+    rules = StopRules(stop=["User:"], grammar=True)
+    terminator, budget = rules.start("hi", 200)
+    assert budget == 200
+    assert feed_all(terminator, ['{"a": "User: b"}']) == ('{"a": "User: b"}', False)
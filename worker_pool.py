@@ -0,0 +1,155 @@
+"""Run get_answer across several processes, each with its own model.
+
+One llama.cpp instance stops getting faster past a certain thread count, so
+on large machines several smaller instances give more aggregate throughput.
+Run this module directly to measure which workers x threads split is best:
+
+    python worker_pool.py questions.jsonl --cores 16
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import ai_agent
+from metrics import MetricsLog
+from model_planner import default_budget
+
+READY_TIMEOUT = 600  # seconds to wait for every worker to load its model
+
+_load_error = None
+
+
+def _init_worker(n_threads: int, memory_budget_mb, barrier):
+    global _load_error
+    ai_agent.N_THREADS = n_threads
+    if memory_budget_mb:
+        ai_agent.MEMORY_BUDGET_MB = memory_budget_mb
+    # The split sets both thread counts; a profile's batch threads would oversubscribe
+    ai_agent.MODEL_OPTIONS.pop("n_threads_batch", None)
+    try:
+        ai_agent.load_model()
+    except Exception as e:
+        _load_error = e
+    try:
+        index = barrier.wait(READY_TIMEOUT)
+    except threading.BrokenBarrierError:
+        index = os.getpid()
+    # Every worker logs to a file of its own; rotating one file shared
+    # between processes loses records
+    root, ext = os.path.splitext(ai_agent.METRICS_LOG_PATH)
+    ai_agent.metrics_log = MetricsLog(f"{root}-worker{index}{ext}")
+
+
+def _answer(args) -> dict:
+    question, use_cache = args
+    if _load_error is not None:
+        raise _load_error
+    return ai_agent.get_answer_details(question, use_cache=use_cache)
+
+
+def _ready(_) -> bool:
+    return _load_error is None
+
+
+def worker_budget_mb(workers: int):
+    """Memory each of workers processes may plan its model for, in MB, or None when unknown"""
+    budget = ai_agent.MEMORY_BUDGET_MB or (default_budget() or 0) / (1024 * 1024)
+    return int(budget / workers) if budget else None
+
+
+class WorkerPool:
+    """Process pool where every worker loads the model with n_threads threads.
+
+    The memory budget is split evenly between the workers, which would
+    otherwise each plan for the whole machine.
+    """
+
+    def __init__(self, workers: int, threads_per_worker: int = None):
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(workers)
+        self._pool = context.Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, worker_budget_mb(workers), barrier),
+        )
+
+    def wait_ready(self):
+        """Block until every worker has loaded its model"""
+        if not all(self._pool.map(_ready, range(self.workers), chunksize=1)):
+            raise RuntimeError("A worker failed to load the model")
+
+    def imap(self, questions, use_cache: bool = True):
+        """Yield answer details for questions, in input order"""
+        return self._pool.imap(_answer, ((q, use_cache) for q in questions), chunksize=1)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def splits(cores: int) -> list:
+    """All (workers, threads_per_worker) pairs that use exactly cores threads"""
+    return [(workers, cores // workers) for workers in range(1, cores + 1) if cores % workers == 0]
+
+
+def benchmark(questions: list, cores: int) -> list:
+    """Measure steady-state throughput for each workers x threads split"""
+    results = []
+    for workers, threads in splits(cores):
+        load_start = time.perf_counter()
+        with WorkerPool(workers, threads) as pool:
+            pool.wait_ready()
+            load_seconds = time.perf_counter() - load_start
+
+            start = time.perf_counter()
+            tokens = sum(r["completion_tokens"] for r in pool.imap(questions, use_cache=False))
+            elapsed = time.perf_counter() - start
+
+        result = {
+            "workers": workers,
+            "threads_per_worker": threads,
+            "load_seconds": round(load_seconds, 2),
+            "requests": len(questions),
+            "seconds": round(elapsed, 2),
+            "req_per_s": round(len(questions) / elapsed, 3),
+            "tok_per_s": round(tokens / elapsed, 1),
+        }
+        print(
+            f"{workers:>3} workers x {threads:>3} threads: "
+            f"{result['req_per_s']:.3f} req/s, {result['tok_per_s']:.1f} tok/s "
+            f"(load {result['load_seconds']:.1f}s)"
+        )
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    from batch import read_questions
+
+    parser = argparse.ArgumentParser(description="Benchmark workers x threads splits for batch inference")
+    parser.add_argument("input", help="JSONL file of questions (same format as batch.py)")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="total threads to split across workers")
+    parser.add_argument("--limit", type=int, default=32, help="questions to answer per split")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    questions = [q for _, q in read_questions(args.input)][:args.limit]
+    results = benchmark(questions, args.cores)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()